@@ -4,9 +4,14 @@ import json
 import time
 import struct
 import serial
-import datetime
+import logging
+import argparse
 import collections
 
+import logpipe
+import profiling
+import timeutil
+
 # 同步字节
 SYNC_WORD = 0x8A
 # 8 个 float（4 字节 * 8） + 1 字节校验
@@ -14,6 +19,11 @@ PACKET_SIZE = struct.calcsize("<8fB")
 
 usv_list = collections.deque(maxlen=60)
 
+# 运行时剖析（--profile 或 SIGUSR1 开启）
+profiler = profiling.Profiler("air_data")
+
+log = logging.getLogger("air_data")
+
 
 def avg(arr):
     if not arr:
@@ -46,38 +56,38 @@ def read_exact(ser: serial.Serial, n: int) -> bytes:
 
 def read_sensor_packet(ser: serial.Serial):
     """从串口不断读，找到 SYNC_WORD 后读取一个完整数据包并解析"""
-    # 等待同步字节（一直扫，直到读到 0x8A）
-    while True:
-        b = ser.read(1)
-        if not b:
-            return None  # 超时
-        if b[0] == SYNC_WORD:
-            break
-
-    # 读出后面的数据包（尽量读满）
-    packet = read_exact(ser, PACKET_SIZE)
-    if len(packet) != PACKET_SIZE:
-        return None
-
-    float_bytes = packet[:32]  # 前 32 字节是 8 个 float
-    recv_checksum = packet[32]  # 最后一字节是校验（int）
-
-    if calculate_checksum(float_bytes) != recv_checksum:
-        print(
-            f"{datetime.datetime.now().strftime('[%H:%M:%S]')} 校验失败，丢弃本次数据"
-        )
-        return None
-
-    (
-        temperature,
-        humidity,
-        pressure_hpa,
-        usv,
-        pm1p0,
-        pm2p5,
-        pm4p0,
-        pm10,
-    ) = struct.unpack("<8f", float_bytes)
+    with profiler.stage("read"):
+        # 等待同步字节（一直扫，直到读到 0x8A）
+        while True:
+            b = ser.read(1)
+            if not b:
+                return None  # 超时
+            if b[0] == SYNC_WORD:
+                break
+
+        # 读出后面的数据包（尽量读满）
+        packet = read_exact(ser, PACKET_SIZE)
+        if len(packet) != PACKET_SIZE:
+            return None
+
+    with profiler.stage("decode"):
+        float_bytes = packet[:32]  # 前 32 字节是 8 个 float
+        recv_checksum = packet[32]  # 最后一字节是校验（int）
+
+        if calculate_checksum(float_bytes) != recv_checksum:
+            log.warning("校验失败，丢弃本次数据")
+            return None
+
+        (
+            temperature,
+            humidity,
+            pressure_hpa,
+            usv,
+            pm1p0,
+            pm2p5,
+            pm4p0,
+            pm10,
+        ) = struct.unpack("<8f", float_bytes)
 
     return {
         "temperature": float(temperature),
@@ -119,29 +129,33 @@ def open_serial_forever(
                 ser.reset_input_buffer()
             except Exception:
                 pass
-            print(
-                f"{datetime.datetime.now().strftime('[%H:%M:%S]')} 已连接串口: {port}"
-            )
+            log.info("已连接串口: %s", port)
             return ser
         except Exception as e:
-            print(
-                f"{datetime.datetime.now().strftime('[%H:%M:%S]')} 打开串口失败，2 秒后重试喵～ {e}"
-            )
+            log.warning("打开串口失败，2 秒后重试喵～ %s", e)
             time.sleep(2)
 
 
 def main():
+    parser = argparse.ArgumentParser(description="主站串口采集")
+    profiling.add_arguments(parser)
+    logpipe.add_arguments(parser)
+    args = parser.parse_args()
+    frame_log = logpipe.setup_from_args(args)
+    profiling.setup(profiler, args)
+
     serial_port = "/dev/station"
     baudrate = 115200
 
     output_json = "/var/www/html/data.json"
 
-    print(f"使用稳定串口路径: {serial_port}，波特率 {baudrate}")
+    log.info("使用稳定串口路径: %s，波特率 %s", serial_port, baudrate)
     ser = open_serial_forever(serial_port, baudrate, timeout=5)
 
     try:
         while True:
             try:
+                profiler.tick()
                 sensor = read_sensor_packet(ser)
 
                 if sensor:
@@ -157,16 +171,14 @@ def main():
                         "pm10": sensor["pm10"],
                         "usv": sensor["usv"],
                         "usv_avg": avg(usv_list),
-                        "create_at": datetime.datetime.now().strftime(
-                            "%Y-%m-%d %H:%M:%S"
-                        ),
+                        "create_at": timeutil.now_ms(),
                     }
 
-                    atomic_write_json(output_json, data)
+                    with profiler.stage("publish"):
+                        atomic_write_json(output_json, data)
 
-                    print(
-                        f"{datetime.datetime.now().strftime('[%H:%M:%S]')} 写入数据: {data}"
-                    )
+                    if frame_log():
+                        log.info("写入数据: %s", data)
                     time.sleep(0.1)
                 else:
                     # 没读到有效包就稍微歇一下，避免空转占 CPU
@@ -174,9 +186,7 @@ def main():
 
             except (serial.SerialException, OSError) as e:
                 # 断线/多进程抢占/设备异常：关闭并重连
-                print(
-                    f"{datetime.datetime.now().strftime('[%H:%M:%S]')} 串口断开/异常，准备重连喵～ {e}"
-                )
+                log.warning("串口断开/异常，准备重连喵～ %s", e)
                 try:
                     ser.close()
                 except Exception:
@@ -186,13 +196,11 @@ def main():
 
             except Exception as e:
                 # 其它异常：不中断主循环
-                print(
-                    f"{datetime.datetime.now().strftime('[%H:%M:%S]')} 本轮异常，继续运行喵～ 错误: {e}"
-                )
+                log.error("本轮异常，继续运行喵～ 错误: %s", e)
                 time.sleep(1)
 
     except KeyboardInterrupt:
-        print("\n退出程序喵～")
+        log.info("退出程序喵～")
 
     finally:
         try:
@@ -4,9 +4,13 @@ import json
 import time
 import struct
 import serial
-import datetime
+import logging
+import argparse
 import tempfile
 
+import logpipe
+import timeutil
+
 SYNC_WORD = 0x8A
 PACKET_SIZE = struct.calcsize("<fffB")
 
@@ -21,8 +25,7 @@ STALE_SECONDS = 180  # 3分钟，你也可以改成 120/300
 RECONNECT_SLEEP = 2
 
 
-def now_str():
-    return datetime.datetime.now().strftime("[%H:%M:%S]")
+log = logging.getLogger("air_data_seis")
 
 
 def calculate_checksum(data_bytes: bytes) -> int:
@@ -61,7 +64,7 @@ def open_serial(port_path: str, baudrate: int) -> serial.Serial:
     while True:
         try:
             if not os.path.exists(port_path):
-                print(f"{now_str()} 串口路径不存在，等待设备出现喵… {port_path}")
+                log.warning("串口路径不存在，等待设备出现喵… %s", port_path)
                 time.sleep(RECONNECT_SLEEP)
                 continue
 
@@ -77,12 +80,12 @@ def open_serial(port_path: str, baudrate: int) -> serial.Serial:
             ser.reset_input_buffer()
             ser.reset_output_buffer()
 
-            print(f"{now_str()} 已打开串口：{port_path} @ {baudrate}")
+            log.info("已打开串口：%s @ %s", port_path, baudrate)
             time.sleep(0.5)
             return ser
 
         except (serial.SerialException, OSError) as e:
-            print(f"{now_str()} 打开串口失败，稍后重试喵… 错误: {e}")
+            log.warning("打开串口失败，稍后重试喵… 错误: %s", e)
             time.sleep(RECONNECT_SLEEP)
 
 
@@ -107,7 +110,7 @@ def read_sensor_packet(ser: serial.Serial):
     recv_checksum = packet[12]
 
     if calculate_checksum(float_bytes) != recv_checksum:
-        print(f"{now_str()} 校验失败，丢弃本次数据喵")
+        log.warning("校验失败，丢弃本次数据喵")
         return None
 
     temperature, humidity, pressure = struct.unpack("<fff", float_bytes)
@@ -115,11 +118,15 @@ def read_sensor_packet(ser: serial.Serial):
 
 
 def main():
+    parser = argparse.ArgumentParser(description="地震仪测站串口采集")
+    logpipe.add_arguments(parser)
+    frame_log = logpipe.setup_from_args(parser.parse_args())
+
     ser = None
     last_good_time = 0.0
     last_write_time = 0.0
 
-    print(f"启动喵～目标串口 {SERIAL_PORT}，波特率 {BAUDRATE}")
+    log.info("启动喵～目标串口 %s，波特率 %s", SERIAL_PORT, BAUDRATE)
 
     while True:
         try:
@@ -138,13 +145,14 @@ def main():
                     "temperature": sensor["temperature"],
                     "humidity": sensor["humidity"],
                     "pressure": sensor["pressure"],
-                    "create_at": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                    "create_at": timeutil.now_ms(),
                 }
 
                 # 按你的逻辑：每次成功后写入，然后 sleep 60s
                 atomic_write_json(OUTPUT_FILE, data)
                 last_write_time = time.time()
-                print(f"{now_str()} 写入数据: {data}")
+                if frame_log():
+                    log.info("写入数据: %s", data)
 
                 time.sleep(60)
                 continue
@@ -158,12 +166,12 @@ def main():
             time.sleep(0.05)
 
         except KeyboardInterrupt:
-            print("\n退出程序喵～")
+            log.info("退出程序喵～")
             break
 
         except (serial.SerialException, OSError) as e:
             # 典型掉线异常
-            print(f"{now_str()} 串口异常/掉线，准备重连喵… 错误: {e}")
+            log.warning("串口异常/掉线，准备重连喵… 错误: %s", e)
 
             try:
                 if ser is not None:
@@ -175,7 +183,7 @@ def main():
 
         except Exception as e:
             # 其它异常（含假死触发）
-            print(f"{now_str()} 异常，准备重连喵… 错误: {e}")
+            log.warning("异常，准备重连喵… 错误: %s", e)
 
             try:
                 if ser is not None:
@@ -189,7 +197,7 @@ def main():
     try:
         if ser is not None:
             ser.close()
-            print("串口已关闭喵～")
+            log.info("串口已关闭喵～")
     except Exception:
         pass
 
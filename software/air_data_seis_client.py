@@ -1,9 +1,23 @@
 # -*- coding: utf-8 -*-
+import os
 import json
 import time
+import logging
 import requests
-import datetime
 
+import archive
+import logpipe
+import timeutil
+from air_data_seis import atomic_write_json
+
+logpipe.setup()
+log = logging.getLogger("air_data_seis_client")
+os.makedirs(os.path.dirname(archive.SEIS_SPOOL), exist_ok=True)
+
+# 见过的最大 create_at（data_seis.json 只往前走）和最近见过的全部 create_at
+# （晚到的样本也只进 spool 一次）
+max_create_at = None
+recent = archive.RecentTimes()
 while True:
     try:
         esp8266_data = requests.get("http://192.168.0.11/data_seis.json", timeout=10).json()
@@ -11,12 +25,25 @@ while True:
             "temperature": esp8266_data["temperature"],
             "humidity": esp8266_data["humidity"],
             "pressure": esp8266_data["pressure"],
-            "create_at": esp8266_data["create_at"],
+            # 远端可能还是旧版（时间字符串），统一成 epoch 毫秒
+            "create_at": timeutil.to_ms(esp8266_data["create_at"]),
         }
-        with open("/var/www/html/data_seis.json", "w", encoding="utf-8") as f:
-            json.dump(data, f)
+        # 每条没见过的样本都进 spool，plot_seis 下次轮询全部取走，晚到的样本
+        # 不会被下一条覆盖掉；data_seis.json 是给网页看的“当前值”，
+        # 只有比见过的都新的样本才更新它，晚到的不会让页面倒退
+        create_at = data["create_at"]
+        now = timeutil.now_ms()
+        if create_at > now + timeutil.MAX_CLOCK_SKEW_MS:
+            log.warning("远端时钟超前 %d s，样本丢弃", (create_at - now) // 1000)
+        elif recent.add(create_at, now):
+            archive.append(archive.SEIS_SPOOL, json.dumps(data) + "\n")
+            if max_create_at is None or create_at > max_create_at:
+                atomic_write_json("/var/www/html/data_seis.json", data)
+                max_create_at = create_at
+            else:
+                log.warning("远端样本晚到 %d s", (max_create_at - create_at) // 1000)
         time.sleep(60)
     except Exception as e:
-        print(f"{datetime.datetime.now().strftime('[%H:%M:%S]')} Error: {e}")
+        log.error("Error: %s", e)
         time.sleep(1)
         continue
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+历史 / 归档 JSONL 的追加写，和整文件重写（derived.py 回填）共用一把 flock。
+
+重写方在锁内把追加到旧文件的行处理完再 os.replace；
+追加方拿到锁后先确认路径还指向手里这个文件，被替换了就重新打开新文件再写，
+这样回填期间追加的行不会落到旧 inode 上丢掉。
+
+归档按追加顺序写，不保证时间严格有序（远端补发的晚到样本会追加在后面），
+query.py 的索引对此有容错，见 iter_range。写入方用 RecentTimes 按时间戳去重，
+并且只写 [now - lateness, now + MAX_CLOCK_SKEW_MS] 内的样本：时间戳在未来的行
+会把索引的前缀最大值顶上去，之后追加的行就都查不到了。
+
+同一套锁也用于“spool”：生产方（air_data_seis_client.py）把每条新样本 append 进去，
+消费方（plot_seis.py）drain() 一次取走全部，中间不会漏掉也不会重复取。
+"""
+import os
+import fcntl
+
+import timeutil
+
+# 远端地震仪测站样本的 spool：客户端逐条追加，plot_seis.py 每轮取走
+SEIS_SPOOL = "/var/tmp/weatherstation/seis_spool.jsonl"
+# 归档里一行最多比它前面的行晚这么多（query.py 按这个留余量）
+MAX_LATENESS_MS = 2 * 86_400_000
+
+
+def append(path, text: str):
+    """加锁追加一段文本（整行），并 fsync"""
+    while True:
+        with open(path, "a", encoding="utf-8") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                replaced = os.fstat(f.fileno()).st_ino != os.stat(path).st_ino
+            except FileNotFoundError:
+                replaced = True
+            if replaced:
+                # 等锁期间文件被重写替换了，重新打开
+                continue
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+            return
+
+
+def lock(f):
+    """锁住一个已打开的文件（关闭时自动释放）"""
+    fcntl.flock(f, fcntl.LOCK_EX)
+
+
+def drain(path) -> list:
+    """
+    取走 spool 里现有的全部行：加锁后先删掉路径再读，
+    之后的追加方拿到锁会发现文件已不在，自动写到新文件。
+    """
+    try:
+        f = open(path, "r", encoding="utf-8")
+    except FileNotFoundError:
+        return []
+    with f:
+        lock(f)
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        return f.readlines()
+
+
+class RecentTimes:
+    """
+    最近写进历史 / 归档的样本时间戳，与图表网格无关地去重。
+    lateness 之前的时间戳不再记，也不再接受，集合大小有上限。
+    """
+
+    def __init__(self, lateness: int = MAX_LATENESS_MS):
+        self.lateness = int(lateness)
+        self.times = set()
+
+    def seed(self, times):
+        """启动时用历史文件里已有的时间戳初始化"""
+        self.times.update(int(t) for t in times)
+
+    def add(self, t: int, now: int) -> bool:
+        """t 没写过且时间合理就记下并返回 True（调用方接着写历史）"""
+        lo = now - self.lateness
+        if not lo <= t <= now + timeutil.MAX_CLOCK_SKEW_MS or t in self.times:
+            return False
+        self.times.add(t)
+        self.times = {x for x in self.times if x >= lo}
+        return True
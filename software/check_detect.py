@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+detect.py 的一致性检查：同一段输入分别用逐帧 update() 和向量化 replay() 跑，
+分数和事件翻转点必须一致（调阈值全靠 replay，两者不一致就白调了）。
+
+覆盖平稳段（舍入误差最容易变成假分数）、阶跃、量化后大量重复的随机序列，
+以及“先 replay 一段再接着 update”的衔接。
+
+用法：
+    python check_detect.py
+"""
+import sys
+
+import numpy as np
+
+import detect
+
+# 分数的允许误差：两条路径的浮点运算顺序不同，阶跃后方差衰减到下限附近时
+# 分数只有 1e-6 量级的噪声，远低于任何阈值；翻转点要求完全一致
+SCORE_TOL = 1e-5
+
+
+def inputs():
+    rng = np.random.default_rng(0)
+    yield "constant", [0.12] * 3000
+    yield "step", [0.1] * 2000 + [0.2] * 2000 + [0.1] * 2000
+    yield "large-step", [1013.25] * 1500 + [1009.75] * 1500
+    # usv 按 0.01 量化、PM 取整：大量连续重复值
+    yield "quantized-usv", np.round(0.12 + 0.01 * rng.standard_normal(20000), 2)
+    pm = np.round(np.abs(30 + 5 * rng.standard_normal(20000)))
+    pm[8000:8050] += 80
+    yield "quantized-pm", pm
+
+
+def detectors():
+    yield "ewma", lambda: detect.EwmaDetector(on=1.5, off=0.5)
+    yield "ewma-default", lambda: detect.EwmaDetector()
+    yield "cusum", lambda: detect.CusumDetector(alpha=0.01, k=0.02, on=0.5, off=0.1)
+    yield "cusum-diff", lambda: detect.CusumDetector(
+        alpha=0.01, k=0.05, on=1.0, off=0.2, direction="down", diff=True
+    )
+
+
+def run_update(det, x):
+    scores = []
+    transitions = []
+    for i, v in enumerate(x):
+        kind = det.update(float(v))
+        scores.append(det.score)
+        if kind:
+            transitions.append((i, kind))
+    return np.array(scores), transitions
+
+
+def check(name, make, x) -> bool:
+    x = np.asarray(x, dtype=np.float64)
+    live_scores, live = run_update(make(), x)
+    replay_scores, replayed = make().replay(x)
+
+    # 先 replay 前半段，再逐帧接着跑后半段
+    half = len(x) // 2
+    mixed = make()
+    _, head = mixed.replay(x[:half])
+    tail_scores, tail = run_update(mixed, x[half:])
+    mixed_t = head + [(i + half, k) for i, k in tail]
+
+    ok = True
+    err = np.max(np.abs(live_scores - replay_scores)) if len(x) else 0.0
+    if err > SCORE_TOL:
+        print(f"FAIL {name}: 分数最大偏差 {err:.3g}")
+        ok = False
+    if live != replayed:
+        print(f"FAIL {name}: update {live[:6]} != replay {replayed[:6]}")
+        ok = False
+    if live != mixed_t:
+        print(f"FAIL {name}: update {live[:6]} != replay+update {mixed_t[:6]}")
+        ok = False
+    if ok:
+        print(f"ok   {name}: {len(live)} 次翻转，分数最大偏差 {err:.2g}")
+    return ok
+
+
+def main():
+    failed = 0
+    for x_name, x in inputs():
+        for d_name, make in detectors():
+            if not check(f"{d_name}/{x_name}", make, x):
+                failed += 1
+    if failed:
+        print(f"{failed} 项不一致喵…")
+        sys.exit(1)
+    print("全部一致喵～")
+
+
+if __name__ == "__main__":
+    main()
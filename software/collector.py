@@ -0,0 +1,384 @@
+# -*- coding: utf-8 -*-
+"""
+多串口采集器：一个进程里用 selectors(epoll) 同时收多台测站的数据。
+
+每台测站 = 一个串口 + 一种数据包格式 + 波特率 + 输出文件。
+所有串口都以非阻塞方式注册到同一个 selector，哪个口有数据就解哪个，
+不再是一台测站一个进程、一个阻塞循环。
+
+用法：
+    python collector.py                      # 使用下面的 STATIONS
+    python collector.py --config stations.json
+"""
+import os
+import json
+import time
+import struct
+import serial
+import logging
+import argparse
+import selectors
+import collections
+
+import detect
+import derived
+import logpipe
+import profiling
+import timeutil
+from air_data_seis import calculate_checksum, atomic_write_json
+
+SYNC_WORD = 0x8A
+SYNC_BYTE = bytes([SYNC_WORD])
+
+# 数据包格式：struct 格式（不含同步字节和校验字节） + 字段名（按包内顺序）
+SCHEMAS = {
+    # 主站：8 个 float，见 firmware/src/main.cpp
+    "main": (
+        "<8f",
+        (
+            "temperature",
+            "humidity",
+            "pressure",
+            "usv",
+            "pm1.0",
+            "pm2.5",
+            "pm4.0",
+            "pm10",
+        ),
+    ),
+    # 地震仪测站：3 个 float，见 firmware-seis/src/main.cpp
+    "seis": ("<3f", ("temperature", "humidity", "pressure")),
+}
+
+# 默认测站列表（--config 可以用 JSON 文件覆盖，格式相同）
+# min_interval：两次写输出文件之间的最短间隔（秒），期间只保留最新一帧
+# altitude：测站海拔（米），填了才计算海平面气压
+STATIONS = [
+    {
+        "name": "main",
+        "port": "/dev/station",
+        "baudrate": 115200,
+        "schema": "main",
+        "output": "/var/www/html/data.json",
+        "min_interval": 0,
+        "altitude": None,
+    },
+    {
+        "name": "seis",
+        "port": "/dev/serial/by-id/usb-1a86_USB_Serial-if00-port0",
+        "baudrate": 19200,
+        "schema": "seis",
+        "output": "/var/www/html/data_seis.json",
+        "min_interval": 60,
+        "altitude": None,
+    },
+]
+
+# 超过多久没有成功拿到一帧有效数据，就认为“假死”并重连
+STALE_SECONDS = 180
+# 重连等待间隔
+RECONNECT_SLEEP = 2
+# 每次从串口最多读多少字节
+READ_CHUNK = 4096
+# usv 滑动平均窗口（与 air_data.py 一致）
+USV_AVG_SIZE = 60
+
+# 运行时剖析（--profile 或 SIGUSR1 开启）
+profiler = profiling.Profiler("collector")
+
+log = logging.getLogger("collector")
+
+
+class PacketDecoder:
+    """
+    流式解包：喂进任意长度的字节，吐出所有完整且校验通过的帧。
+    半包留在缓冲区里等下一次 feed。
+    """
+
+    def __init__(self, fmt: str, fields):
+        self.struct = struct.Struct(fmt)
+        self.fields = tuple(fields)
+        # 同步字节之后：数据 + 1 字节校验
+        self.size = self.struct.size + 1
+        self.buf = bytearray()
+        self.checksum_failures = 0
+
+    def feed(self, chunk: bytes):
+        buf = self.buf
+        buf += chunk
+        n = len(buf)
+        body_size = self.struct.size
+        frames = []
+        pos = 0
+        while True:
+            i = buf.find(SYNC_BYTE, pos)
+            if i < 0:
+                # 没有同步字节，全部丢掉
+                pos = n
+                break
+            if n - i - 1 < self.size:
+                # 半包，等下次
+                pos = i
+                break
+            start = i + 1
+            body = buf[start : start + body_size]
+            if calculate_checksum(body) != buf[start + body_size]:
+                # 校验失败：可能是数据里碰巧出现的 0x8A，从下一个字节继续找
+                self.checksum_failures += 1
+                pos = start
+                continue
+            frames.append(self.struct.unpack_from(buf, start))
+            pos = start + self.size
+        if pos:
+            del buf[:pos]
+        return frames
+
+
+class Station:
+    """一台测站的串口、解包状态和输出配置"""
+
+    def __init__(
+        self,
+        name: str,
+        port: str,
+        baudrate: int,
+        schema: str = "main",
+        output: str = None,
+        min_interval: float = 0.0,
+        detectors: dict = None,
+        altitude: float = None,
+    ):
+        fmt, fields = SCHEMAS[schema]
+        self.name = name
+        self.port = port
+        self.baudrate = int(baudrate)
+        self.output = output
+        self.min_interval = float(min_interval)
+        self.log = logging.getLogger(f"collector.{name}")
+        self.frame_log = logpipe.FrameSampler(0)
+        self.decoder = PacketDecoder(fmt, fields)
+        # 在线异常检测（只挂本测站有的通道）
+        self.detectors = detect.DetectorBank(name, detectors, fields)
+        self.events = []
+        # 派生通道（露点、AQI、当日剂量……）逐帧标量计算
+        self.derived = derived.DerivedEngine(fields, altitude)
+
+        self.ser = None
+        self.fd = None
+        self.last_good = 0.0
+        self.next_retry = 0.0
+        self.last_publish = 0.0
+        self.pending = None
+        self.frames = 0
+
+        self.usv_list = (
+            collections.deque(maxlen=USV_AVG_SIZE) if "usv" in fields else None
+        )
+
+    def make_record(self, values) -> dict:
+        """把解出来的一帧转成要发布的 dict"""
+        data = dict(zip(self.decoder.fields, values))
+        if self.usv_list is not None:
+            self.usv_list.append(data["usv"])
+            data["usv_avg"] = sum(self.usv_list) / len(self.usv_list)
+        data["create_at"] = timeutil.now_ms()
+        data.update(self.derived.update(data, data["create_at"]))
+        # 本帧触发的事件留给 collector 写事件日志，当前活跃的事件随数据一起发布
+        self.events = self.detectors.process(data)
+        data["events"] = self.detectors.active()
+        return data
+
+
+class Collector:
+    """
+    把所有测站注册到一个 selector 上，poll() 处理一轮就绪事件。
+    sink(station, record) 会在每解出一帧时被调用（可选）。
+    log_frames：每台测站每 N 帧记一次数据日志，0 关闭。
+    """
+
+    def __init__(
+        self,
+        stations,
+        sink=None,
+        event_log: str = detect.EVENT_LOG,
+        log_frames: int = 0,
+    ):
+        self.stations = list(stations)
+        self.sink = sink
+        for st in self.stations:
+            st.frame_log = logpipe.FrameSampler(log_frames)
+        self.event_log = detect.EventLog(event_log) if event_log else None
+        self.sel = selectors.DefaultSelector()
+
+    def _open(self, st: Station, now: float):
+        try:
+            ser = serial.Serial(
+                port=st.port,
+                baudrate=st.baudrate,
+                timeout=0,  # 非阻塞，真正的等待交给 selector
+                write_timeout=1,
+                exclusive=True,
+            )
+            ser.reset_input_buffer()
+        except (serial.SerialException, OSError) as e:
+            st.log.warning("打开串口失败，稍后重试喵… 错误: %s", e)
+            st.next_retry = now + RECONNECT_SLEEP
+            return
+        st.ser = ser
+        st.fd = ser.fileno()
+        st.last_good = now
+        st.decoder.buf.clear()
+        self.sel.register(st.fd, selectors.EVENT_READ, st)
+        st.log.info("已打开串口：%s @ %s", st.port, st.baudrate)
+
+    def _close(self, st: Station, now: float, reason):
+        st.log.warning("串口异常/掉线，准备重连喵… 错误: %s", reason)
+        try:
+            self.sel.unregister(st.fd)
+        except (KeyError, ValueError):
+            pass
+        try:
+            st.ser.close()
+        except Exception:
+            pass
+        st.ser = None
+        st.fd = None
+        st.next_retry = now + RECONNECT_SLEEP
+
+    def _publish(self, st: Station, now: float):
+        try:
+            with profiler.stage("publish"):
+                atomic_write_json(st.output, st.pending)
+        except OSError as e:
+            st.log.error("写入失败喵… 错误: %s", e)
+            return
+        st.last_publish = now
+        st.pending = None
+
+    def _log_events(self, st: Station):
+        for e in st.events:
+            st.log.warning(
+                "事件 %s: %s (%s) score=%s",
+                e["event"],
+                e["channel"],
+                e["detector"],
+                e["score"],
+            )
+        if self.event_log is None:
+            return
+        try:
+            self.event_log.write(st.events)
+        except OSError as e:
+            st.log.error("事件日志写入失败喵… 错误: %s", e)
+
+    def _read(self, st: Station, now: float):
+        try:
+            with profiler.stage("read"):
+                chunk = os.read(st.fd, READ_CHUNK)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            self._close(st, now, e)
+            return
+        if not chunk:
+            self._close(st, now, "EOF")
+            return
+
+        with profiler.stage("decode"):
+            frames = st.decoder.feed(chunk)
+        if not frames:
+            return
+        st.last_good = now
+        for values in frames:
+            with profiler.stage("record"):
+                record = st.make_record(values)
+            st.frames += 1
+            if st.events:
+                self._log_events(st)
+            if st.frame_log():
+                st.log.info("写入数据: %s", record)
+            if self.sink is not None:
+                self.sink(st, record)
+            st.pending = record
+
+    def poll(self, timeout: float = 1.0):
+        profiler.tick()
+        now = time.monotonic()
+        for st in self.stations:
+            if st.ser is None and now >= st.next_retry:
+                self._open(st, now)
+
+        if self.sel.get_map():
+            events = self.sel.select(timeout)
+        else:
+            time.sleep(timeout)
+            events = ()
+
+        now = time.monotonic()
+        for key, _ in events:
+            self._read(key.data, now)
+
+        for st in self.stations:
+            if (
+                st.pending is not None
+                and st.output
+                and now - st.last_publish >= st.min_interval
+            ):
+                self._publish(st, now)
+            if st.ser is not None and now - st.last_good > STALE_SECONDS:
+                self._close(st, now, f"超过 {STALE_SECONDS}s 未收到有效数据，判定假死")
+
+    def close(self):
+        for st in self.stations:
+            if st.ser is not None:
+                try:
+                    self.sel.unregister(st.fd)
+                except (KeyError, ValueError):
+                    pass
+                try:
+                    st.ser.close()
+                except Exception:
+                    pass
+                st.ser = None
+                st.fd = None
+        self.sel.close()
+
+    def run(self):
+        try:
+            while True:
+                self.poll()
+        except KeyboardInterrupt:
+            log.info("退出程序喵～")
+        finally:
+            self.close()
+
+
+def load_stations(path: str = None):
+    """读取测站配置（JSON 列表），没给路径就用 STATIONS"""
+    conf = STATIONS
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            conf = json.load(f)
+    return [Station(**c) for c in conf]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="多串口测站采集器")
+    parser.add_argument("--config", help="测站配置 JSON 文件（默认用内置 STATIONS）")
+    parser.add_argument("--event-log", default=detect.EVENT_LOG, help="事件日志路径")
+    profiling.add_arguments(parser)
+    logpipe.add_arguments(parser)
+    args = parser.parse_args()
+    logpipe.setup(args.log_level, args.log_window)
+    profiling.setup(profiler, args)
+
+    stations = load_stations(args.config)
+    for st in stations:
+        st.log.info("%s @ %s -> %s", st.port, st.baudrate, st.output)
+    Collector(
+        stations, event_log=args.event_log, log_frames=args.log_frames
+    ).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+紧凑的二进制列式历史文件（.bin），给网页和分析脚本直接按类型数组加载。
+
+布局（全部小端）：
+    0   8 字节 magic  b"WSCOL1\\0\\0"
+    8   uint32        JSON 头长度 H（已补空格到 8 字节对齐）
+    12  uint32        行数 N
+    16  JSON 头       {"version", "rows", "channels", "offsets"}
+    16+H             int64   时间戳列（epoch 毫秒）× N
+    ...              float32 数值列 × N，按 channels 顺序依次排列，缺失值为 NaN
+
+每一列的起始字节偏移都写在头里的 offsets，且都按元素大小对齐，
+浏览器端可以零拷贝地建视图：
+    const buf = await (await fetch("history.bin")).arrayBuffer();
+    const dv = new DataView(buf);
+    const hlen = dv.getUint32(8, true), n = dv.getUint32(12, true);
+    const head = JSON.parse(new TextDecoder().decode(new Uint8Array(buf, 16, hlen)));
+    const t = new BigInt64Array(buf, head.offsets.t, n);
+    const pm25 = new Float32Array(buf, head.offsets["pm2.5"], n);
+Python 端用 read()（np.frombuffer / mmap）。
+"""
+import os
+import json
+import mmap
+import struct
+
+import numpy as np
+
+MAGIC = b"WSCOL1\0\0"
+PREFIX = struct.Struct("<8sII")
+VERSION = 1
+
+
+def encode(t, columns: dict) -> bytes:
+    """
+    t: epoch 毫秒序列；columns: {通道名: 数值序列}（长度都与 t 相同）。
+    序列可以是 list / deque / ndarray，None 记为 NaN。
+    """
+    ts = np.asarray(t, dtype="<i8")
+    n = len(ts)
+    names = list(columns)
+    cols = []
+    for name in names:
+        col = np.asarray(columns[name], dtype="<f4")
+        if len(col) != n:
+            raise ValueError(f"列 {name} 长度 {len(col)} 与时间戳 {n} 不一致")
+        cols.append(col)
+
+    # 头长度依赖偏移、偏移又依赖头长度：先按占位长度算一遍，对齐后再定
+    head = {"version": VERSION, "rows": n, "channels": names, "offsets": {}}
+    hlen = 0
+    while True:
+        data_off = PREFIX.size + hlen
+        offsets = {"t": data_off}
+        off = data_off + 8 * n
+        for name in names:
+            offsets[name] = off
+            off += 4 * n
+        head["offsets"] = offsets
+        raw = json.dumps(head, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        need = (len(raw) + 7) // 8 * 8
+        if need == hlen:
+            break
+        hlen = need
+    raw = raw.ljust(hlen, b" ")
+
+    parts = [PREFIX.pack(MAGIC, hlen, n), raw, ts.tobytes()]
+    parts += [c.tobytes() for c in cols]
+    return b"".join(parts)
+
+
+def write(path: str, t, columns: dict):
+    """原子写入：先写临时文件再 os.replace，避免浏览器读到半截文件"""
+    data = encode(t, columns)
+    tmp = f"{path}.tmp"
+    try:
+        with open(tmp, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    finally:
+        try:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        except Exception:
+            pass
+
+
+def decode(buf):
+    """从 bytes / mmap 解析，返回 (t: int64 数组, {通道名: float32 数组})，零拷贝"""
+    magic, hlen, n = PREFIX.unpack_from(buf, 0)
+    if magic != MAGIC:
+        raise ValueError("不是 WSCOL1 列式文件")
+    head = json.loads(bytes(buf[PREFIX.size : PREFIX.size + hlen]))
+    offsets = head["offsets"]
+    t = np.frombuffer(buf, dtype="<i8", count=n, offset=offsets["t"])
+    cols = {
+        name: np.frombuffer(buf, dtype="<f4", count=n, offset=offsets[name])
+        for name in head["channels"]
+    }
+    return t, cols
+
+
+def read(path: str):
+    """mmap 打开并解析；返回的数组引用 mmap，随用随读"""
+    with open(path, "rb") as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return decode(buf)
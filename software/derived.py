@@ -0,0 +1,352 @@
+# -*- coding: utf-8 -*-
+"""
+派生量引擎：露点、绝对湿度、海平面气压、PM2.5/PM10 空气质量分指数、当日累计辐射剂量。
+
+每个公式只写一次，写成对“数学命名空间” m 的函数：
+    - 采集端逐帧计算时 m = 标量实现（math + bisect），单帧开销只有几微秒
+    - 回填历史 / 查询时 m = NumPy，整列向量化计算
+派生通道和实测通道一样进入发布的 JSON、历史文件、图表和导出。
+
+回填已有历史（给每行补上派生字段，原子替换原文件）：
+    python derived.py /var/www/html/archive.jsonl --altitude 50
+"""
+import os
+import json
+import math
+import time
+import bisect
+import argparse
+import collections
+
+import numpy as np
+
+import archive
+import timeutil
+
+# Magnus 公式系数（水面，-45 ~ 60 ℃）
+MAGNUS_A = 17.62
+MAGNUS_B = 243.12
+# 标准大气温度递减率（K/m）
+LAPSE_RATE = 0.0065
+
+# HJ 633-2012 空气质量分指数分段（24 小时平均浓度限值，μg/m³ -> IAQI）
+IAQI = (0, 50, 100, 150, 200, 300, 400, 500)
+PM25_BREAKPOINTS = (0, 35, 75, 115, 150, 250, 350, 500)
+PM10_BREAKPOINTS = (0, 50, 150, 250, 350, 420, 500, 600)
+
+# 剂量积分：两帧间隔超过这个值（ms）视为断档，不计入
+DOSE_MAX_GAP_MS = 15 * 60 * 1000
+DAY_MS = 86_400_000
+
+
+class _ScalarMath:
+    """逐帧计算用的标量实现"""
+
+    exp = staticmethod(math.exp)
+    log = staticmethod(math.log)
+
+    @staticmethod
+    def clip(x, lo, hi):
+        return min(max(x, lo), hi)
+
+    @staticmethod
+    def interp(x, xs, ys):
+        """与 np.interp 相同：分段线性，两端截断"""
+        if x <= xs[0]:
+            return float(ys[0])
+        if x >= xs[-1]:
+            return float(ys[-1])
+        i = bisect.bisect_right(xs, x)
+        x0, x1 = xs[i - 1], xs[i]
+        y0, y1 = ys[i - 1], ys[i]
+        return y0 + (y1 - y0) * (x - x0) / (x1 - x0)
+
+
+class _VectorMath:
+    """批量计算用的 NumPy 实现"""
+
+    exp = staticmethod(np.exp)
+    log = staticmethod(np.log)
+    clip = staticmethod(np.clip)
+    interp = staticmethod(np.interp)
+
+
+SCALAR = _ScalarMath()
+VECTOR = _VectorMath()
+
+
+# ---------- 公式（只写一次） ----------
+
+
+def dew_point(m, temperature, humidity):
+    """露点（℃），Magnus 公式"""
+    rh = m.clip(humidity, 0.1, 100.0)
+    gamma = m.log(rh / 100.0) + MAGNUS_A * temperature / (MAGNUS_B + temperature)
+    return MAGNUS_B * gamma / (MAGNUS_A - gamma)
+
+
+def abs_humidity(m, temperature, humidity):
+    """绝对湿度（g/m³）"""
+    es = 6.112 * m.exp(MAGNUS_A * temperature / (MAGNUS_B + temperature))
+    return es * humidity * 2.1674 / (273.15 + temperature)
+
+
+def sea_level_pressure(m, pressure, temperature, altitude):
+    """海平面气压（hPa），测高公式，altitude 为测站海拔（m）"""
+    h = LAPSE_RATE * altitude
+    return pressure * (1.0 - h / (temperature + h + 273.15)) ** -5.257
+
+
+def aqi_pm25(m, pm25):
+    """PM2.5 空气质量分指数（按 24 h 限值分段，瞬时浓度仅供参考）"""
+    return m.interp(pm25, PM25_BREAKPOINTS, IAQI)
+
+
+def aqi_pm10(m, pm10):
+    """PM10 空气质量分指数"""
+    return m.interp(pm10, PM10_BREAKPOINTS, IAQI)
+
+
+# 派生通道声明：名字 -> (输入通道, 公式, 需要的测站参数)
+Derived = collections.namedtuple("Derived", "inputs func params")
+
+DERIVED = {
+    "dew_point": Derived(("temperature", "humidity"), dew_point, ()),
+    "abs_humidity": Derived(("temperature", "humidity"), abs_humidity, ()),
+    "sea_level_pressure": Derived(
+        ("pressure", "temperature"), sea_level_pressure, ("altitude",)
+    ),
+    "aqi_pm2.5": Derived(("pm2.5",), aqi_pm25, ()),
+    "aqi_pm10": Derived(("pm10",), aqi_pm10, ()),
+}
+
+# 当日累计剂量（μSv）：需要时间戳，按本地自然日清零
+DOSE_CHANNEL = "usv_dose"
+DOSE_INPUT = "usv"
+
+
+def inputs_of(name: str):
+    """派生通道需要的实测输入"""
+    return DERIVED[name].inputs if name in DERIVED else (DOSE_INPUT,)
+
+
+def _utc_offset_ms(ms: int) -> int:
+    return time.localtime(ms / 1000).tm_gmtoff * 1000
+
+
+def _local_day(ms: int) -> int:
+    return (ms + _utc_offset_ms(ms)) // DAY_MS
+
+
+def day_start_ms(ms: int) -> int:
+    """ms 所在本地自然日的零点（epoch 毫秒）"""
+    return _local_day(ms) * DAY_MS - _utc_offset_ms(ms)
+
+
+class DerivedEngine:
+    """
+    按可用的实测通道和测站参数选出能算的派生通道。
+    update() 逐帧（标量），compute() 整列（向量化）；两者共用同一份剂量状态，
+    所以可以先用 compute() 回放历史，再接着 update()。
+    """
+
+    def __init__(self, channels, altitude: float = None):
+        channels = set(channels)
+        params = {"altitude": altitude}
+        self.channels = {}
+        for name, d in DERIVED.items():
+            if not set(d.inputs) <= channels:
+                continue
+            if any(params[p] is None for p in d.params):
+                continue
+            self.channels[name] = (d, {p: params[p] for p in d.params})
+        self.dose = DOSE_INPUT in channels
+        self.names = list(self.channels) + ([DOSE_CHANNEL] if self.dose else [])
+        # 剂量积分状态：上一帧时间、上一帧所在日、当日累计
+        self.last_ts = None
+        self.last_day = None
+        self.dose_total = 0.0
+
+    def update(self, record: dict, ts: int = None) -> dict:
+        """逐帧计算，返回 {派生通道: 值}；输入缺失或算不出的通道跳过"""
+        out = {}
+        for name, (d, params) in self.channels.items():
+            try:
+                args = [float(record[c]) for c in d.inputs]
+                out[name] = float(d.func(SCALAR, *args, **params))
+            except (KeyError, TypeError, ValueError, ArithmeticError):
+                continue
+        if self.dose and ts is not None:
+            try:
+                usv = float(record[DOSE_INPUT])
+            except (KeyError, TypeError, ValueError):
+                usv = math.nan
+            # 时间戳不比上一帧新（晚到 / 重复）的样本不计入，也不回拨积分时间；
+            # usv 缺失或非有限值时这一段不计入，但时间照常前进（与 compute() 一致）
+            if self.last_ts is None or ts > self.last_ts:
+                day = _local_day(ts)
+                if day != self.last_day:
+                    self.dose_total = 0.0
+                elif ts - self.last_ts <= DOSE_MAX_GAP_MS and math.isfinite(usv):
+                    self.dose_total += usv * (ts - self.last_ts) / 3_600_000
+                self.last_ts = ts
+                self.last_day = day
+            out[DOSE_CHANNEL] = self.dose_total
+        return out
+
+    def compute(self, columns: dict, ts=None) -> dict:
+        """
+        整列计算：columns 为 {实测通道: 数组}，ts 为 epoch 毫秒数组（算剂量需要）。
+        缺失值用 NaN，结果里对应位置也是 NaN。
+        """
+        cols = {k: np.asarray(v, dtype=np.float64) for k, v in columns.items()}
+        out = {}
+        with np.errstate(invalid="ignore", divide="ignore", over="ignore"):
+            for name, (d, params) in self.channels.items():
+                if all(c in cols for c in d.inputs):
+                    out[name] = d.func(VECTOR, *(cols[c] for c in d.inputs), **params)
+        if self.dose and ts is not None and DOSE_INPUT in cols:
+            out[DOSE_CHANNEL] = self._dose_vector(np.asarray(ts, dtype=np.int64), cols[DOSE_INPUT])
+        return out
+
+    def _dose_vector(self, ts, usv):
+        n = len(ts)
+        if n == 0:
+            return np.zeros(0)
+        # 本地自然日编号：时区偏移在这段数据里不变就用常数，否则逐个算（夏令时）
+        off0 = _utc_offset_ms(int(ts[0]))
+        if off0 == _utc_offset_ms(int(ts[-1])):
+            day = (ts + off0) // DAY_MS
+        else:
+            day = np.array([_local_day(t) for t in ts.tolist()], dtype=np.int64)
+
+        # 积分时间只前进：每个样本的“上一帧”是它之前出现过的最大时间戳
+        if self.last_ts is None:
+            ts0, day0 = int(ts[0]) - 1, int(day[0]) - 1
+        else:
+            ts0, day0 = self.last_ts, self.last_day
+        prev_ts = np.empty(n, dtype=np.int64)
+        prev_ts[0] = ts0
+        prev_ts[1:] = np.maximum(np.maximum.accumulate(ts)[:-1], ts0)
+        prev_day = np.empty(n, dtype=np.int64)
+        prev_day[0] = day0
+        prev_day[1:] = np.maximum(np.maximum.accumulate(day)[:-1], day0)
+
+        dt = ts - prev_ts
+        forward = dt > 0
+        new_day = forward & (day != prev_day)
+        ok = forward & ~new_day & (dt <= DOSE_MAX_GAP_MS) & np.isfinite(usv)
+        with np.errstate(invalid="ignore"):
+            inc = np.where(ok, usv * dt / 3_600_000, 0.0)
+        # 分日累加：整体 cumsum 后减去每天开始前的累计值
+        cs = np.cumsum(inc)
+        start = np.maximum.accumulate(np.where(new_day, np.arange(n), 0))
+        base = np.where(start > 0, cs[start - 1], 0.0)
+        dose = cs - base
+        if not new_day[0]:
+            # 接着上一段（同一天）继续累加
+            first_day_end = np.flatnonzero(new_day)
+            stop = first_day_end[0] if len(first_day_end) else n
+            dose[:stop] += self.dose_total
+
+        self.last_ts = max(ts0, int(ts.max()))
+        self.last_day = max(day0, int(day.max()))
+        self.dose_total = float(dose[-1])
+        return dose
+
+
+# 回填时可能用到的全部实测输入
+ALL_INPUTS = sorted({c for d in DERIVED.values() for c in d.inputs} | {DOSE_INPUT})
+
+
+def _read_chunk(src, chunk_rows: int):
+    """读一块行；解析不了的行原样保留（str），回填时原样写回"""
+    rows = []
+    for line in src:
+        try:
+            rows.append(json.loads(line))
+        except ValueError:
+            rows.append(line if line.endswith("\n") else line + "\n")
+        if len(rows) >= chunk_rows:
+            break
+    return rows
+
+
+def backfill(path: str, altitude: float = None, chunk_rows: int = 65536):
+    """
+    给历史 JSONL 的每一行补上派生字段（已有的覆盖），原子替换原文件。
+    派生通道按整个文件里出现过的实测字段决定，不看某一行；
+    最后在 archive 锁内把回填期间追加进来的行也处理掉再替换，一行都不丢。
+    """
+    tmp = f"{path}.tmp"
+    engine = DerivedEngine(ALL_INPUTS, altitude)
+    seen = set()
+    total = 0
+    last_t = 0
+
+    def process(rows, dst):
+        nonlocal total, last_t
+        records = [r for r in rows if isinstance(r, dict)]
+        for r in records:
+            seen.update(r.keys())
+        ts = []
+        for r in records:
+            try:
+                last_t = timeutil.to_ms(r["t"])
+            except (KeyError, ValueError):
+                pass
+            ts.append(last_t)
+        columns = {c: [_num(r.get(c)) for r in records] for c in ALL_INPUTS}
+        derived = engine.compute(columns, ts)
+        for name, values in derived.items():
+            # 文件里从没出现过输入字段的派生通道不写
+            if not seen.issuperset(inputs_of(name)):
+                continue
+            for r, v in zip(records, values.tolist()):
+                r[name] = None if math.isnan(v) else round(v, 4)
+        dst.writelines(
+            r if isinstance(r, str) else json.dumps(r, ensure_ascii=False) + "\n"
+            for r in rows
+        )
+        total += len(rows)
+
+    with open(path, "r", encoding="utf-8") as src, open(tmp, "w", encoding="utf-8") as dst:
+        while True:
+            rows = _read_chunk(src, chunk_rows)
+            if not rows:
+                break
+            process(rows, dst)
+        # 锁住原文件：追加方此时只能等，拿到锁后会发现文件已被替换并改写新文件
+        archive.lock(src)
+        while True:
+            rows = _read_chunk(src, chunk_rows)
+            if not rows:
+                break
+            process(rows, dst)
+        dst.flush()
+        os.fsync(dst.fileno())
+        os.chmod(tmp, os.stat(path).st_mode & 0o777)
+        os.replace(tmp, path)
+    return total, [n for n in engine.names if seen.issuperset(inputs_of(n))]
+
+
+def _num(v):
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def main():
+    parser = argparse.ArgumentParser(description="给历史文件回填派生通道")
+    parser.add_argument("history", help="历史 JSONL 文件（会被原子替换）")
+    parser.add_argument("--altitude", type=float, default=None, help="测站海拔（米）")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    total, names = backfill(args.history, args.altitude)
+    print(f"回填 {total} 行：{', '.join(names)}，用时 {time.perf_counter() - t0:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
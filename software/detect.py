@@ -0,0 +1,415 @@
+# -*- coding: utf-8 -*-
+"""
+在线异常/事件检测：每个通道挂若干检测器（EWMA z-score、CUSUM），
+每来一帧每个检测器 O(1) 更新一次，带开/关两个阈值做迟滞，
+状态翻转时产生一条事件（start / end）。
+
+同一套检测器也能在历史数据上用 NumPy 向量化重放，用来调阈值：
+    python detect.py /var/www/html/history.jsonl --channel usv --detector ewma --on 3,4,5
+"""
+import json
+import math
+import time
+import argparse
+
+import numpy as np
+
+import timeutil
+
+# 默认检测配置：通道 -> [(检测器类型, 参数), ...]
+# on/off：分数 >= on 开始事件，<= off 结束事件（off < on 形成迟滞）
+DETECTORS = {
+    "usv": [
+        ("ewma", {"alpha": 0.05, "on": 4.0, "off": 2.0, "direction": "up"}),
+        ("cusum", {"alpha": 0.01, "k": 0.02, "on": 0.5, "off": 0.1, "direction": "up"}),
+    ],
+    "pm2.5": [
+        ("ewma", {"alpha": 0.05, "on": 4.0, "off": 2.0, "direction": "up"}),
+    ],
+    "pm10": [
+        ("ewma", {"alpha": 0.05, "on": 4.0, "off": 2.0, "direction": "up"}),
+    ],
+    # 气压骤降：对相邻两帧的差值做 CUSUM
+    "pressure": [
+        (
+            "cusum",
+            {"alpha": 0.01, "k": 0.05, "on": 1.0, "off": 0.2, "direction": "down", "diff": True},
+        ),
+    ],
+}
+
+EVENT_LOG = "/var/www/html/events.jsonl"
+
+# EWMA 方差的相对下限：方差小于 (VAR_FLOOR_REL * max(1, |均值|))² 时视为 0，z 记 0。
+# 平稳段（量化后的 usv / PM 经常连着几十帧不变）的残差和方差都只剩舍入误差，
+# 两个噪声相除会得到 O(1) 的假分数；逐帧和重放都按这个下限处理才能一致。
+VAR_FLOOR_REL = 1e-9
+
+
+def _ewma_filter(u, a: float, b: float, y0: float):
+    """
+    向量化一阶递推 y[i] = a * y[i-1] + b * u[i]（y[-1] = y0）。
+    分块用 y[i] = a^i * (y0 + b * Σ u[j] * a^-j) 计算，块长保证 a^-j 不溢出。
+    """
+    u = np.asarray(u, dtype=np.float64)
+    out = np.empty_like(u)
+    n = len(u)
+    if n == 0:
+        return out
+    if a <= 0.0:
+        out[:] = b * u
+        return out
+    block = n if a >= 1.0 else max(1, min(n, int(20.0 / -math.log(a))))
+    pw = a ** np.arange(1, block + 1, dtype=np.float64)
+    for s in range(0, n, block):
+        seg = u[s : s + block]
+        p = pw[: len(seg)]
+        y = p * (y0 + b * np.cumsum(seg / p))
+        out[s : s + len(seg)] = y
+        y0 = y[-1]
+    return out
+
+
+def _var_floor(mean):
+    """方差下限，mean 可以是标量或数组"""
+    return (VAR_FLOOR_REL * np.maximum(1.0, np.abs(mean))) ** 2
+
+
+def _directed(score, direction: str):
+    if direction == "up":
+        return score
+    if direction == "down":
+        return -score
+    return abs(score)
+
+
+class _Detector:
+    """公共部分：迟滞状态机"""
+
+    kind = ""
+
+    def __init__(self, on: float, off: float, direction: str = "up"):
+        if off > on:
+            raise ValueError(f"off={off} 不能大于 on={on}")
+        self.on = float(on)
+        self.off = float(off)
+        self.direction = direction
+        self.active = False
+        self.score = 0.0
+
+    def _transition(self, score: float):
+        """返回 "start" / "end" / None"""
+        self.score = score
+        if not self.active and score >= self.on:
+            self.active = True
+            return "start"
+        if self.active and score <= self.off:
+            self.active = False
+            return "end"
+        return None
+
+    def _replay_transitions(self, scores):
+        """向量化迟滞：只在翻转点之间二分查找，返回 [(index, kind), ...]"""
+        above = np.flatnonzero(scores >= self.on)
+        below = np.flatnonzero(scores <= self.off)
+        out = []
+        pos = 0
+        while True:
+            idx = below if self.active else above
+            k = np.searchsorted(idx, pos)
+            if k == len(idx):
+                break
+            i = int(idx[k])
+            out.append((i, "end" if self.active else "start"))
+            self.active = not self.active
+            pos = i + 1
+        if len(scores):
+            self.score = float(scores[-1])
+        return out
+
+
+class EwmaDetector(_Detector):
+    """EWMA 均值/方差，分数 = 本帧相对上一帧基线的 z-score"""
+
+    kind = "ewma"
+
+    def __init__(self, alpha=0.05, on=4.0, off=2.0, direction="up", warmup=30):
+        super().__init__(on, off, direction)
+        self.alpha = float(alpha)
+        self.warmup = int(warmup)
+        self.mean = 0.0
+        self.var = 0.0
+        self.n = 0
+
+    def update(self, x: float):
+        if self.n == 0:
+            self.mean = x
+            self.n = 1
+            return self._transition(0.0)
+        d = x - self.mean
+        floor = (VAR_FLOOR_REL * max(1.0, abs(self.mean))) ** 2
+        z = d / math.sqrt(self.var) if self.var > floor else 0.0
+        a = 1.0 - self.alpha
+        self.mean += self.alpha * d
+        self.var = a * (self.var + self.alpha * d * d)
+        self.n += 1
+        if self.n <= self.warmup:
+            z = 0.0
+        return self._transition(_directed(z, self.direction))
+
+    def replay(self, x):
+        """在数组上重放，结果与逐帧 update() 一致；返回 (scores, transitions)"""
+        x = np.asarray(x, dtype=np.float64)
+        scores = np.zeros(len(x))
+        if len(x) == 0:
+            return scores, []
+        first = 0
+        if self.n == 0:
+            self.mean = float(x[0])
+            self.n = 1
+            first = 1
+        xs = x[first:]
+        if len(xs):
+            a = 1.0 - self.alpha
+            mean = _ewma_filter(xs, a, self.alpha, self.mean)
+            mean_prev = np.concatenate(([self.mean], mean[:-1]))
+            d = xs - mean_prev
+            var = _ewma_filter(d * d, a, a * self.alpha, self.var)
+            var_prev = np.concatenate(([self.var], var[:-1]))
+            with np.errstate(divide="ignore", invalid="ignore"):
+                z = np.where(var_prev > _var_floor(mean_prev), d / np.sqrt(var_prev), 0.0)
+            # 与 update() 相同：处理完第 i 帧后样本数为 n + i + 1
+            counts = self.n + 1 + np.arange(len(xs))
+            z[counts <= self.warmup] = 0.0
+            scores[first:] = _directed(z, self.direction)
+            self.mean = float(mean[-1])
+            self.var = float(var[-1])
+            self.n += len(xs)
+        return scores, self._replay_transitions(scores)
+
+
+class CusumDetector(_Detector):
+    """
+    单边 CUSUM：残差 = 输入 - EWMA 基线，g = max(0, g + 残差 - k)。
+    diff=True 时输入是相邻两帧的差值（用来抓气压骤降这类变化率事件）。
+    """
+
+    kind = "cusum"
+
+    def __init__(
+        self, alpha=0.01, k=0.0, on=5.0, off=1.0, direction="up", diff=False
+    ):
+        if direction not in ("up", "down"):
+            raise ValueError("CUSUM 只支持 up / down")
+        super().__init__(on, off, direction)
+        self.alpha = float(alpha)
+        self.k = float(k)
+        self.diff = bool(diff)
+        self.base = None
+        self.prev = None
+        self.g = 0.0
+
+    def update(self, x: float):
+        if self.diff:
+            prev, self.prev = self.prev, x
+            if prev is None:
+                return self._transition(0.0)
+            x = x - prev
+        if self.base is None:
+            self.base = x
+            return self._transition(0.0)
+        r = _directed(x - self.base, self.direction)
+        self.base += self.alpha * (x - self.base)
+        self.g = max(0.0, self.g + r - self.k)
+        return self._transition(self.g)
+
+    def replay(self, x):
+        x = np.asarray(x, dtype=np.float64)
+        scores = np.zeros(len(x))
+        if len(x) == 0:
+            return scores, []
+        first = 0
+        if self.diff:
+            prev = self.prev
+            self.prev = float(x[-1])
+            if prev is None:
+                u = np.diff(x)
+                first = 1
+            else:
+                u = np.diff(x, prepend=prev)
+        else:
+            u = x
+        if len(u) and self.base is None:
+            self.base = float(u[0])
+            u = u[1:]
+            first += 1
+        if len(u):
+            a = 1.0 - self.alpha
+            base = _ewma_filter(u, a, self.alpha, self.base)
+            base_prev = np.concatenate(([self.base], base[:-1]))
+            step = _directed(u - base_prev, self.direction) - self.k
+            # g[i] = max(0, g[i-1] + step[i]) 的闭式解：C[i] - min(-g0, min C[..i])
+            c = np.cumsum(step)
+            g = c - np.minimum(np.minimum.accumulate(c), -self.g)
+            scores[first:] = g
+            self.base = float(base[-1])
+            self.g = float(g[-1])
+        return scores, self._replay_transitions(scores)
+
+
+DETECTOR_TYPES = {
+    EwmaDetector.kind: EwmaDetector,
+    CusumDetector.kind: CusumDetector,
+}
+
+
+def build_detectors(config=None, channels=None):
+    """按配置生成 [(通道, 检测器), ...]；channels 给了就只保留其中的通道"""
+    config = DETECTORS if config is None else config
+    out = []
+    for channel, specs in config.items():
+        if channels is not None and channel not in channels:
+            continue
+        for kind, params in specs:
+            out.append((channel, DETECTOR_TYPES[kind](**params)))
+    return out
+
+
+class DetectorBank:
+    """一台测站的全部检测器，collector 每帧调用一次 process()"""
+
+    def __init__(self, station: str, config=None, channels=None):
+        self.station = station
+        self.detectors = build_detectors(config, channels)
+        self.since = {}
+
+    def process(self, record: dict):
+        """返回本帧产生的事件列表（通常为空）"""
+        events = []
+        for channel, det in self.detectors:
+            value = record.get(channel)
+            if value is None:
+                continue
+            kind = det.update(float(value))
+            if kind is None:
+                continue
+            key = (channel, det.kind)
+            if kind == "start":
+                self.since[key] = record.get("create_at")
+            event = {
+                "t": record.get("create_at"),
+                "station": self.station,
+                "channel": channel,
+                "detector": det.kind,
+                "event": kind,
+                "score": round(det.score, 4),
+                "value": value,
+            }
+            if kind == "end":
+                event["since"] = self.since.pop(key, None)
+            events.append(event)
+        return events
+
+    def active(self):
+        """当前处于事件中的检测器，写进发布的 JSON"""
+        return [
+            {
+                "channel": channel,
+                "detector": det.kind,
+                "since": self.since.get((channel, det.kind)),
+                "score": round(det.score, 4),
+            }
+            for channel, det in self.detectors
+            if det.active
+        ]
+
+
+class EventLog:
+    """只追加的事件日志（JSONL）"""
+
+    def __init__(self, path: str = EVENT_LOG):
+        self.path = path
+
+    def write(self, events):
+        if not events:
+            return
+        with open(self.path, "a", encoding="utf-8") as f:
+            for e in events:
+                f.write(json.dumps(e, ensure_ascii=False) + "\n")
+            f.flush()
+
+
+def load_channel(path: str, channel: str):
+    """从历史 JSONL 里取一个通道：返回 (epoch 毫秒列表, 数值数组)，跳过坏行"""
+    ts = []
+    values = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+                v = float(row[channel])
+                t = timeutil.to_ms(row["t"])
+            except Exception:
+                continue
+            ts.append(t)
+            values.append(v)
+    return ts, np.asarray(values, dtype=np.float64)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="在历史数据上重放检测器，调阈值用")
+    parser.add_argument("history", help="历史 JSONL 文件")
+    parser.add_argument("--channel", required=True)
+    parser.add_argument("--detector", default="ewma", choices=sorted(DETECTOR_TYPES))
+    parser.add_argument("--on", default=None, help="开阈值，可用逗号给多个做扫描")
+    parser.add_argument("--off", type=float, default=None)
+    parser.add_argument("--alpha", type=float, default=None)
+    parser.add_argument("--k", type=float, default=None, help="CUSUM 容许偏差")
+    parser.add_argument("--direction", default=None)
+    parser.add_argument("--diff", action="store_true", help="CUSUM 对差值检测")
+    parser.add_argument("--events", action="store_true", help="打印每个事件")
+    args = parser.parse_args()
+
+    ts, x = load_channel(args.history, args.channel)
+    print(f"{args.channel}: {len(x)} 个样本")
+
+    # 以默认配置为底，命令行参数覆盖
+    params = {}
+    for kind, p in DETECTORS.get(args.channel, []):
+        if kind == args.detector:
+            params = dict(p)
+            break
+    for name in ("off", "alpha", "k", "direction"):
+        if getattr(args, name) is not None:
+            params[name] = getattr(args, name)
+    if args.diff:
+        params["diff"] = True
+    if args.detector != "cusum":
+        params.pop("k", None)
+        params.pop("diff", None)
+
+    ons = [float(v) for v in args.on.split(",")] if args.on else [params.get("on")]
+    for on in ons:
+        p = dict(params)
+        if on is not None:
+            p["on"] = on
+        if "on" in p and "off" not in p:
+            p["off"] = p["on"] / 2
+        if "on" in p and p["off"] > p["on"]:
+            p["off"] = p["on"]
+        det = DETECTOR_TYPES[args.detector](**p)
+        t0 = time.perf_counter()
+        scores, transitions = det.replay(x)
+        elapsed = (time.perf_counter() - t0) * 1000
+        starts = sum(1 for _, kind in transitions if kind == "start")
+        print(
+            f"on={det.on:g} off={det.off:g}: {starts} 个事件，"
+            f"最大分数 {scores.max() if len(scores) else 0:.3f}，用时 {elapsed:.1f} ms"
+        )
+        if args.events:
+            for i, kind in transitions:
+                print(f"  {timeutil.format_ms(ts[i])} {kind} {args.channel}={x[i]:g} score={scores[i]:.3f}")
+
+
+if __name__ == "__main__":
+    main()
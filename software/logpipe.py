@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+非阻塞日志管道：替代采集循环里逐帧的 print()。
+
+热循环里 logger.info(...) 只生成一条 LogRecord 丢进有界队列（满了直接丢弃并计数，
+绝不阻塞）；格式化、时间戳、去重和写 stdout（journald）都在后台线程里做。
+
+去重/限流：同一条消息（按 logger + 级别 + 渲染后的文本）在 DEDUP_WINDOW 秒内
+只输出第一次，其余计数，窗口结束时补一行汇总，例如：
+    [12:00:00] WARNING air_data: 校验失败，丢弃本次数据 ×532（最近 60 s）
+
+逐帧数据日志用 FrameSampler 抽样，--log-frames N 表示每 N 帧记一次（默认 60），
+1 为每帧都记，0 关闭。每帧的数据文本都不同，去重管不到，只能靠抽样。
+"""
+import sys
+import copy
+import time
+import queue
+import atexit
+import logging
+import threading
+
+LOG_QUEUE_SIZE = 10000
+DEDUP_WINDOW = 60.0
+# 逐帧数据日志的默认抽样间隔（帧）
+LOG_FRAMES = 60
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+DATE_FORMAT = "[%H:%M:%S]"
+
+_STOP = object()
+_handler = None
+
+
+class _QueueHandler(logging.Handler):
+    """
+    调用方线程里只做 put_nowait，队列满就丢弃。
+    消息在后台线程里才格式化，所以入队前把参数浅拷贝一份，
+    调用方之后再改 dict / list 也不会影响已经记下的这一条。
+    """
+
+    def __init__(self, q: queue.Queue):
+        super().__init__()
+        self.q = q
+        self.dropped = 0
+
+    def emit(self, record):
+        args = record.args
+        if isinstance(args, tuple):
+            record.args = tuple(copy.copy(a) for a in args)
+        elif isinstance(args, dict):
+            record.args = copy.copy(args)
+        try:
+            self.q.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _Writer(threading.Thread):
+    """后台线程：格式化、去重汇总、写流"""
+
+    def __init__(self, q: queue.Queue, handler: _QueueHandler, stream, window: float):
+        super().__init__(name="logpipe", daemon=True)
+        self.q = q
+        self.handler = handler
+        self.stream = stream
+        self.window = window
+        self.formatter = logging.Formatter(LOG_FORMAT, DATE_FORMAT)
+        # key -> [窗口开始时间, 被抑制条数, 最近一条 record]
+        self.seen = {}
+        self.reported_drops = 0
+
+    def _write(self, record):
+        try:
+            self.stream.write(self.formatter.format(record) + "\n")
+        except Exception:
+            pass
+
+    def _summary(self, record, count: int, elapsed: float):
+        record.msg = f"{record.getMessage()} ×{count}（最近 {elapsed:.0f} s）"
+        record.args = None
+        record.exc_info = None
+        record.exc_text = None
+        self._write(record)
+
+    def _handle(self, record, now: float):
+        key = (record.name, record.levelno, record.getMessage())
+        entry = self.seen.get(key)
+        if entry is not None and now - entry[0] < self.window:
+            entry[1] += 1
+            entry[2] = record
+            return
+        if entry is not None and entry[1]:
+            self._summary(entry[2], entry[1], now - entry[0])
+        self.seen[key] = [now, 0, record]
+        self._write(record)
+
+    def _expire(self, now: float, force: bool = False):
+        for key, (start, count, record) in list(self.seen.items()):
+            if force or now - start >= self.window:
+                if count:
+                    self._summary(record, count, now - start)
+                del self.seen[key]
+        dropped = self.handler.dropped
+        if dropped != self.reported_drops:
+            self.stream.write(
+                f"{time.strftime(DATE_FORMAT)} WARNING logpipe: "
+                f"日志队列已满，丢弃 {dropped - self.reported_drops} 条\n"
+            )
+            self.reported_drops = dropped
+
+    def run(self):
+        last_expire = time.monotonic()
+        while True:
+            try:
+                record = self.q.get(timeout=1.0)
+            except queue.Empty:
+                record = None
+            # 一次把队列里现有的都处理掉，最后统一 flush
+            while record is not None:
+                if record is _STOP:
+                    self._expire(time.monotonic(), force=True)
+                    self.stream.flush()
+                    return
+                self._handle(record, time.monotonic())
+                try:
+                    record = self.q.get_nowait()
+                except queue.Empty:
+                    record = None
+            now = time.monotonic()
+            if now - last_expire >= 1.0:
+                self._expire(now)
+                last_expire = now
+            try:
+                self.stream.flush()
+            except Exception:
+                pass
+
+
+class FrameSampler:
+    """每 every 帧返回一次 True；every <= 0 表示关闭"""
+
+    def __init__(self, every: int = 1):
+        self.every = int(every)
+        self.n = 0
+
+    def __call__(self) -> bool:
+        if self.every <= 0:
+            return False
+        self.n += 1
+        if self.n >= self.every:
+            self.n = 0
+            return True
+        return False
+
+
+def setup(level="INFO", window: float = DEDUP_WINDOW, stream=None):
+    """给 root logger 装上队列 handler，并启动后台写线程（只需调用一次）"""
+    global _handler
+    if _handler is not None:
+        return
+    q = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    _handler = _QueueHandler(q)
+    root = logging.getLogger()
+    root.handlers[:] = [_handler]
+    root.setLevel(level)
+    writer = _Writer(q, _handler, stream or sys.stdout, window)
+    writer.start()
+
+    def _stop():
+        # 退出前把队列里剩下的写完
+        try:
+            q.put(_STOP, timeout=1.0)
+        except queue.Full:
+            return
+        writer.join(timeout=2.0)
+
+    atexit.register(_stop)
+
+
+def add_arguments(parser, frames: int = LOG_FRAMES):
+    """给各脚本的 argparse 加上日志相关参数"""
+    parser.add_argument(
+        "--log-level", default="INFO", choices=("DEBUG", "INFO", "WARNING", "ERROR")
+    )
+    parser.add_argument(
+        "--log-frames",
+        type=int,
+        default=frames,
+        help=f"每 N 帧记一次数据日志（默认 {frames}，1 为每帧，0 关闭）",
+    )
+    parser.add_argument(
+        "--log-window", type=float, default=DEDUP_WINDOW, help="重复日志合并窗口（秒）"
+    )
+
+
+def setup_from_args(args) -> FrameSampler:
+    """按命令行参数初始化日志，返回逐帧数据日志的抽样器"""
+    setup(args.log_level, args.log_window)
+    return FrameSampler(args.log_frames)
@@ -3,26 +3,97 @@ import os
 import time
 import json
 import datetime
-import collections
+import argparse
 from pathlib import Path
 from pyecharts import options as opts
 from pyecharts.charts import Line, Page
 
-temperature_list = collections.deque(maxlen=288)
-humidity_list = collections.deque(maxlen=288)
-pressure_list = collections.deque(maxlen=288)
-pm1p0_list = collections.deque(maxlen=288)
-pm2p5_list = collections.deque(maxlen=288)
-pm4_list = collections.deque(maxlen=288)
-pm10_list = collections.deque(maxlen=288)
-createat_list = collections.deque(maxlen=288)
-radiation_list = collections.deque(maxlen=288)
-radiation_avg_list = collections.deque(maxlen=288)
+import archive
+import columnar
+import derived
+import logpipe
+import profiling
+import resample
+import timeutil
+
+# 测站海拔（米），填了才计算海平面气压
+STATION_ALTITUDE = None
+# 派生通道（露点、绝对湿度、AQI、当日剂量……），与实测通道一起进历史和图表
+derived_engine = derived.DerivedEngine(
+    ("temperature", "humidity", "pressure", "pm2.5", "pm10", "usv"), STATION_ALTITUDE
+)
+
+# 实测通道 -> (y 轴名, 标题, 输出文件)
+CHARTS = {
+    "temperature": ("温度 (℃)", "温度", "/var/www/html/temperature.html"),
+    "humidity": ("湿度 (%RH)", "湿度", "/var/www/html/humidity.html"),
+    "pressure": ("大气压 (hPa)", "大气压", "/var/www/html/pressure.html"),
+    "usv": ("电离辐射 (μSv/h)", "电离辐射", "/var/www/html/radiation.html"),
+    "usv_avg": (
+        "电离辐射 (μSv/h)",
+        "电离辐射(小时均值)",
+        "/var/www/html/radiation_avg.html",
+    ),
+    "pm1.0": ("PM1.0 (μg/m³)", "PM1.0", "/var/www/html/pm1.0.html"),
+    "pm2.5": ("PM2.5 (μg/m³)", "PM2.5", "/var/www/html/pm2.5.html"),
+    "pm4.0": ("PM4 (μg/m³)", "PM4", "/var/www/html/pm4.html"),
+    "pm10": ("PM10 (μg/m³)", "PM10", "/var/www/html/pm10.html"),
+}
+# 派生通道 -> (y 轴名, 标题, 输出文件)
+DERIVED_CHARTS = {
+    "dew_point": ("露点 (℃)", "露点", "/var/www/html/dew_point.html"),
+    "abs_humidity": ("绝对湿度 (g/m³)", "绝对湿度", "/var/www/html/abs_humidity.html"),
+    "sea_level_pressure": (
+        "海平面气压 (hPa)",
+        "海平面气压",
+        "/var/www/html/sea_level_pressure.html",
+    ),
+    "aqi_pm2.5": ("IAQI", "PM2.5 空气质量分指数", "/var/www/html/aqi_pm2.5.html"),
+    "aqi_pm10": ("IAQI", "PM10 空气质量分指数", "/var/www/html/aqi_pm10.html"),
+    "usv_dose": ("累计剂量 (μSv)", "当日累计辐射剂量", "/var/www/html/usv_dose.html"),
+}
+# get_data() 返回的元组里实测通道的顺序
+FIELDS = (
+    "temperature",
+    "humidity",
+    "pressure",
+    "pm1.0",
+    "pm2.5",
+    "pm4.0",
+    "pm10",
+    "usv",
+    "usv_avg",
+)
+CHANNELS = FIELDS + tuple(derived_engine.names)
+
+# 图表和 history.bin 用的固定时间网格：RESOLUTION 一格，共 WINDOW_MS
+# 原始样本按格聚合（默认取均值，当日累计剂量取最后一个），没数据的格是缺口
+RESOLUTION = "5m"
+WINDOW_MS = 24 * 3600 * 1000
+# 多久读一次 data.json（秒）；create_at 没变的重复数据不记
+POLL_SECONDS = 60
+AGGS = {"usv_dose": "last"}
 
 HISTORY_PATH = Path("/var/www/html/history.jsonl")
-MAX_POINTS = 288  # 24h * (60/5) = 288
+# 长期归档：不裁剪，供 query.py 按时间段查询
+ARCHIVE_PATH = Path("/var/www/html/archive.jsonl")
+# 与图表同一窗口的二进制列式文件，网页端按类型数组直接加载
+COLUMNAR_PATH = "/var/www/html/history.bin"
 HISTORY_PATH.parent.mkdir(parents=True, exist_ok=True)
 
+# 运行时剖析（--profile 或 SIGUSR1 开启）
+profiler = profiling.Profiler("plot")
+
+
+def make_resampler(width: int) -> resample.Resampler:
+    return resample.Resampler(CHANNELS, width, WINDOW_MS // width, AGGS)
+
+
+resampler = make_resampler(resample.parse_width(RESOLUTION))
+# 已写进历史 / 归档的时间戳：写不写历史按它去重，不看网格收没收
+# （网格会丢掉超出窗口的样本，但那不代表样本不该归档）
+written = archive.RecentTimes(WINDOW_MS)
+
 
 def _to_float(v, name="value"):
     try:
@@ -32,37 +103,70 @@ def _to_float(v, name="value"):
 
 
 def load_history():
-    """启动时恢复最近24小时数据到内存deque"""
+    """启动时把最近 WINDOW_MS 的历史重新装进网格（重复、乱序的行由重采样处理）"""
     if not HISTORY_PATH.exists():
         return
     try:
+        cutoff = timeutil.now_ms() - WINDOW_MS
+        ts = []
+        rows = []
         with HISTORY_PATH.open("r", encoding="utf-8") as f:
-            lines = f.readlines()[-MAX_POINTS:]
-        for line in lines:
-            try:
-                row = json.loads(line)
-                # 兼容字段名：t 为时间
-                createat_list.append(str(row["t"]))
-                temperature_list.append(float(row["temperature"]))
-                humidity_list.append(float(row["humidity"]))
-                pressure_list.append(float(row["pressure"]))
-                pm1p0_list.append(float(row["pm1.0"]))
-                pm2p5_list.append(float(row["pm2.5"]))
-                pm4_list.append(float(row["pm4.0"]))
-                pm10_list.append(float(row["pm10"]))
-                radiation_list.append(float(row["usv"]))
-                radiation_avg_list.append(float(row["usv_avg"]))
-            except Exception:
-                # 跳过坏行
-                continue
+            for line in f:
+                try:
+                    row = json.loads(line)
+                    # 兼容字段名：t 为时间
+                    t = timeutil.to_ms(row["t"])
+                except Exception:
+                    # 跳过坏行
+                    continue
+                if t >= cutoff:
+                    ts.append(t)
+                    rows.append([_num(row.get(ch)) for ch in FIELDS])
+        written.seed(ts)
+        if not ts:
+            return
+        order = sorted(range(len(ts)), key=ts.__getitem__)
+        ts = [ts[i] for i in order]
+        columns = dict(zip(FIELDS, zip(*(rows[i] for i in order))))
+        # 派生通道整列重算（旧历史里没有这些字段），顺便把当日剂量的积分状态接上
+        columns.update(derived_engine.compute(columns, ts))
+        resampler.add(ts, columns, timeutil.now_ms())
     except Exception as e:
         print(
             f"{datetime.datetime.now().strftime('[%H:%M:%S]')} History load error: {e}"
         )
 
 
-def append_history(weather_data):
-    """追加一条数据到历史文件，并裁剪到最多24小时(288条)"""
+def _num(v):
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return float("nan")
+
+
+def _cell(v):
+    """NaN -> None：JSON 里写 null，图表上显示为缺口"""
+    return None if v != v else round(v, 4)
+
+
+def compute_derived(weather_data) -> dict:
+    """逐帧计算派生通道，算不出的记 None"""
+    values = derived_engine.update(
+        {
+            "temperature": weather_data[0],
+            "humidity": weather_data[1],
+            "pressure": weather_data[2],
+            "pm2.5": weather_data[4],
+            "pm10": weather_data[6],
+            "usv": weather_data[7],
+        },
+        weather_data[9],
+    )
+    return {name: _cell(values.get(name, float("nan"))) for name in derived_engine.names}
+
+
+def append_history(weather_data, extra=None):
+    """追加一条数据到历史文件，并裁剪掉 WINDOW_MS 以前的行"""
     row = {
         "t": weather_data[9],
         "temperature": weather_data[0],
@@ -75,18 +179,24 @@ def append_history(weather_data):
         "usv": weather_data[7],
         "usv_avg": weather_data[8],
     }
+    if extra:
+        row.update(extra)
+    line = json.dumps(row, ensure_ascii=False) + "\n"
     try:
-        # 1) 先追加一行
-        with HISTORY_PATH.open("a", encoding="utf-8") as f:
-            f.write(json.dumps(row, ensure_ascii=False) + "\n")
-            f.flush()
-            os.fsync(f.fileno())
+        # 1) 先追加一行（历史文件 + 长期归档）
+        # 归档可能正在被 derived.py 回填重写，追加要和它共用一把锁
+        for path in (HISTORY_PATH, ARCHIVE_PATH):
+            archive.append(path, line)
 
-        # 2) 再裁剪到最多 MAX_POINTS 行（最小实现：读尾部再原子替换）
+        # 2) 再裁剪掉窗口以前的行（读出来再原子替换）
         with HISTORY_PATH.open("r", encoding="utf-8") as f:
             lines = f.readlines()
-        if len(lines) > MAX_POINTS:
-            lines = lines[-MAX_POINTS:]
+        cutoff = weather_data[9] - WINDOW_MS
+        keep = 0
+        while keep < len(lines) and _line_time(lines[keep]) < cutoff:
+            keep += 1
+        if keep:
+            lines = lines[keep:]
             tmp = str(HISTORY_PATH) + ".tmp"
             with open(tmp, "w", encoding="utf-8") as f:
                 f.writelines(lines)
@@ -99,6 +209,25 @@ def append_history(weather_data):
         )
 
 
+def _line_time(line: str) -> int:
+    try:
+        return timeutil.to_ms(json.loads(line)["t"])
+    except Exception:
+        # 坏行当作过期行裁掉
+        return -1
+
+
+def add_sample(weather_data, extra, now: int):
+    """一条新样本进网格，返回收下的条数（重复、太旧或时间戳超前的返回 0）"""
+    columns = dict(zip(FIELDS, weather_data))
+    columns.update(extra)
+    return resampler.add(
+        [weather_data[9]],
+        [[_num(columns.get(ch)) for ch in CHANNELS]],
+        now,
+    )
+
+
 def get_data():
     try:
         with open("/var/www/html/data.json", "r", encoding="utf-8") as f:
@@ -112,14 +241,12 @@ def get_data():
         pm10 = _to_float(data["pm10"], "pm10")
         radiation = _to_float(data["usv"], "usv")
         radiation_avg = _to_float(data["usv_avg"], "usv_avg")
-        # 避免跨天 x 轴重复：尽量用完整时间
-        ca = str(data.get("create_at", "")).strip()
-        if len(ca) >= 19 and ca[4] == "-" and ca[7] == "-" and ca[10] in (" ", "T"):
-            # 形如 2026-01-18 12:34:56 / 2026-01-18T12:34:56
-            create_at = ca[:19].replace("T", " ")
-        else:
-            # 兜底：用本地当前时间
-            create_at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        # epoch 毫秒（兼容旧版采集端的时间字符串）
+        try:
+            create_at = timeutil.to_ms(data["create_at"])
+        except (KeyError, ValueError):
+            # 兜底：用当前时间
+            create_at = timeutil.now_ms()
     except Exception as e:
         print(f"{datetime.datetime.now().strftime('[%H:%M:%S]')} Error: {e}")
         return None
@@ -137,19 +264,49 @@ def get_data():
     )
 
 
+def write_columnar(t, columns):
+    """把当前网格写成列式文件（字段名与 history.jsonl 一致，缺口为 NaN）"""
+    try:
+        columnar.write(COLUMNAR_PATH, t, columns)
+    except Exception as e:
+        print(
+            f"{datetime.datetime.now().strftime('[%H:%M:%S]')} Columnar write error: {e}"
+        )
+
+
+def render():
+    """按当前网格重画所有图表并更新 history.bin"""
+    with profiler.stage("grid"):
+        t, columns = resampler.grid()
+        x = t.tolist()
+    for name, (y_name, title, html_name) in {**CHARTS, **DERIVED_CHARTS}.items():
+        if name in columns:
+            y = [_cell(v) for v in columns[name].tolist()]
+            plot(x, y, y_name, title, html_name)
+    with profiler.stage("write_columnar"):
+        write_columnar(t, columns)
+
+
 def plot(x, y, y_name, plot_name, html_name):
+    with profiler.stage(f"plot {os.path.basename(html_name)}"):
+        _plot(x, y, y_name, plot_name, html_name)
+
+
+def _plot(x, y, y_name, plot_name, html_name):
     line = (
         Line(init_opts=opts.InitOpts(width="100%", height="815px"))
         .add_xaxis(x)
         .add_yaxis(y_name, y, is_smooth=True, label_opts=opts.LabelOpts(is_show=False))
         .set_global_opts(
             title_opts=opts.TitleOpts(title=plot_name),
-            xaxis_opts=opts.AxisOpts(
-                axislabel_opts=opts.LabelOpts(rotate=90, interval=0, is_show=False)
-            ),
+            tooltip_opts=opts.TooltipOpts(trigger="axis"),
+            # 时间轴：x 为 epoch 毫秒，由浏览器按本地时区格式化，数据缺口如实显示
+            xaxis_opts=opts.AxisOpts(type_="time"),
             yaxis_opts=opts.AxisOpts(is_scale=True),
         )
     )
+    # 时间轴的 x 已经在每个 [x, y] 数据点里了，不再重复输出一份 xAxis.data
+    line.options["xAxis"][0].pop("data", None)
     page = Page(layout=Page.SimplePageLayout, page_title=plot_name)
     page.add(line)
     # 原子写入：避免 Nginx/浏览器读到半截文件
@@ -166,90 +323,59 @@ def plot(x, y, y_name, plot_name, html_name):
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="主站数据绘图")
+    parser.add_argument(
+        "--resolution",
+        type=resample.parse_width,
+        default=resample.parse_width(RESOLUTION),
+        help=f"图表网格分辨率（默认 {RESOLUTION}）",
+    )
+    parser.add_argument(
+        "--poll", type=float, default=POLL_SECONDS, help="读取 data.json 的间隔（秒）"
+    )
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    # 剖析的开始 / 报告消息走 logging
+    logpipe.setup()
+    profiling.setup(profiler, args)
+    resampler = make_resampler(args.resolution)
 
     load_history()
 
+    last_create_at = None
+    last_bucket = None
     while True:
         try:
-            weather_data = get_data()
-            if weather_data is not None:
-                append_history(weather_data)
-                temperature_list.append(weather_data[0])
-                humidity_list.append(weather_data[1])
-                pressure_list.append(weather_data[2])
-                pm1p0_list.append(weather_data[3])
-                pm2p5_list.append(weather_data[4])
-                pm4_list.append(weather_data[5])
-                pm10_list.append(weather_data[6])
-                radiation_list.append(weather_data[7])
-                radiation_avg_list.append(weather_data[8])
-                createat_list.append(weather_data[9])
-                plot(
-                    list(createat_list),
-                    list(temperature_list),
-                    "温度 (℃)",
-                    "温度",
-                    "/var/www/html/temperature.html",
-                )
-                plot(
-                    list(createat_list),
-                    list(humidity_list),
-                    "湿度 (%RH)",
-                    "湿度",
-                    "/var/www/html/humidity.html",
-                )
-                plot(
-                    list(createat_list),
-                    list(pressure_list),
-                    "大气压 (hPa)",
-                    "大气压",
-                    "/var/www/html/pressure.html",
-                )
-                plot(
-                    list(createat_list),
-                    list(radiation_list),
-                    "电离辐射 (μSv/h)",
-                    "电离辐射",
-                    "/var/www/html/radiation.html",
-                )
-                plot(
-                    list(createat_list),
-                    list(radiation_avg_list),
-                    "电离辐射 (μSv/h)",
-                    "电离辐射(小时均值)",
-                    "/var/www/html/radiation_avg.html",
-                )
-                plot(
-                    list(createat_list),
-                    list(pm1p0_list),
-                    "PM1.0 (μg/m³)",
-                    "PM1.0",
-                    "/var/www/html/pm1.0.html",
-                )
-                plot(
-                    list(createat_list),
-                    list(pm2p5_list),
-                    "PM2.5 (μg/m³)",
-                    "PM2.5",
-                    "/var/www/html/pm2.5.html",
-                )
-                plot(
-                    list(createat_list),
-                    list(pm4_list),
-                    "PM4 (μg/m³)",
-                    "PM4",
-                    "/var/www/html/pm4.html",
-                )
-                plot(
-                    list(createat_list),
-                    list(pm10_list),
-                    "PM10 (μg/m³)",
-                    "PM10",
-                    "/var/www/html/pm10.html",
-                )
-                time.sleep(300)
-            else:
-                time.sleep(5)
+            profiler.tick()
+            with profiler.stage("read"):
+                weather_data = get_data()
+            # 同一个 create_at 说明采集端还没更新，不重复记；
+            # 重启后重读到已经记过的样本由 written 去重，不再写历史
+            if weather_data is not None and weather_data[9] != last_create_at:
+                last_create_at = weather_data[9]
+                now = timeutil.now_ms()
+                if weather_data[9] > now + timeutil.MAX_CLOCK_SKEW_MS:
+                    # 时钟错误：不进网格、不写历史，也不让剂量积分时间跳到未来
+                    print(
+                        f"{datetime.datetime.now().strftime('[%H:%M:%S]')} "
+                        f"样本时间戳超前本机 {(weather_data[9] - now) // 1000} s，丢弃喵"
+                    )
+                else:
+                    with profiler.stage("derived"):
+                        extra = compute_derived(weather_data)
+                    with profiler.stage("resample"):
+                        add_sample(weather_data, extra, now)
+                    if written.add(weather_data[9], now):
+                        with profiler.stage("append_history"):
+                            append_history(weather_data, extra)
+            # 每进入一个新的格子重画一次；采集端停了窗口也照样往前走，缺口如实显示
+            now = timeutil.now_ms()
+            bucket = now // resampler.width
+            if bucket != last_bucket:
+                last_bucket = bucket
+                resampler.advance(now)
+                render()
+            time.sleep(args.poll)
         except Exception as e:
             print(f"{datetime.datetime.now().strftime('[%H:%M:%S]')} Error: {e}")
             time.sleep(1)
@@ -3,21 +3,73 @@ import os
 import time
 import json
 import datetime
-import collections
+import argparse
 from pathlib import Path
 from pyecharts import options as opts
 from pyecharts.charts import Line, Page
 
-temperature_list = collections.deque(maxlen=288)
-humidity_list = collections.deque(maxlen=288)
-pressure_list = collections.deque(maxlen=288)
-createat_list = collections.deque(maxlen=288)
+import archive
+import columnar
+import derived
+import resample
+import timeutil
+
+# 测站海拔（米），填了才计算海平面气压
+STATION_ALTITUDE = None
+# 派生通道（露点、绝对湿度、海平面气压），与实测通道一起进历史和图表
+derived_engine = derived.DerivedEngine(
+    ("temperature", "humidity", "pressure"), STATION_ALTITUDE
+)
+
+# 实测通道 -> (y 轴名, 标题, 输出文件)
+CHARTS = {
+    "temperature": ("温度 (℃)", "测站环境温度", "/var/www/html/temperature_seis.html"),
+    "humidity": ("湿度 (%RH)", "测站环境湿度", "/var/www/html/humidity_seis.html"),
+    "pressure": ("大气压 (hPa)", "测站环境大气压", "/var/www/html/pressure_seis.html"),
+}
+# 派生通道 -> (y 轴名, 标题, 输出文件)
+DERIVED_CHARTS = {
+    "dew_point": ("露点 (℃)", "测站露点", "/var/www/html/dew_point_seis.html"),
+    "abs_humidity": (
+        "绝对湿度 (g/m³)",
+        "测站绝对湿度",
+        "/var/www/html/abs_humidity_seis.html",
+    ),
+    "sea_level_pressure": (
+        "海平面气压 (hPa)",
+        "测站海平面气压",
+        "/var/www/html/sea_level_pressure_seis.html",
+    ),
+}
+# get_data() 返回的元组里实测通道的顺序
+FIELDS = ("temperature", "humidity", "pressure")
+CHANNELS = FIELDS + tuple(derived_engine.names)
+
+# 图表和 history_seis.bin 用的固定时间网格：RESOLUTION 一格，共 WINDOW_MS，
+# 没数据的格是缺口；远端补发的晚到样本落回原来的格子，重复的只算一次
+RESOLUTION = "5m"
+WINDOW_MS = 24 * 3600 * 1000
+# 多久读一次 data_seis.json（秒），与 air_data_seis_client.py 的拉取间隔一致
+POLL_SECONDS = 60
 
 HISTORY_PATH = Path("/var/www/html/history_seis.jsonl")
-MAX_POINTS = 288  # 24h * (60/5) = 288
+# 长期归档：不裁剪，供 query.py 按时间段查询
+ARCHIVE_PATH = Path("/var/www/html/archive_seis.jsonl")
+# 与图表同一窗口的二进制列式文件，网页端按类型数组直接加载
+COLUMNAR_PATH = "/var/www/html/history_seis.bin"
 HISTORY_PATH.parent.mkdir(parents=True, exist_ok=True)
 
 
+def make_resampler(width: int) -> resample.Resampler:
+    return resample.Resampler(CHANNELS, width, WINDOW_MS // width)
+
+
+resampler = make_resampler(resample.parse_width(RESOLUTION))
+# 已写进历史 / 归档的时间戳：写不写历史按它去重，不看网格收没收
+# （网格会丢掉超出窗口的样本，但那不代表样本不该归档）
+written = archive.RecentTimes(WINDOW_MS)
+
+
 def _to_float(v, name="value"):
     try:
         return float(v)
@@ -26,47 +78,86 @@ def _to_float(v, name="value"):
 
 
 def load_history():
-    """启动时恢复最近24小时数据到内存deque"""
+    """启动时把最近 WINDOW_MS 的历史重新装进网格（重复、乱序的行由重采样处理）"""
     if not HISTORY_PATH.exists():
         return
     try:
+        cutoff = timeutil.now_ms() - WINDOW_MS
+        ts = []
+        rows = []
         with HISTORY_PATH.open("r", encoding="utf-8") as f:
-            lines = f.readlines()[-MAX_POINTS:]
-        for line in lines:
-            try:
-                row = json.loads(line)
-                createat_list.append(str(row["t"]))
-                temperature_list.append(float(row["temperature"]))
-                humidity_list.append(float(row["humidity"]))
-                pressure_list.append(float(row["pressure"]))
-            except Exception:
-                continue
+            for line in f:
+                try:
+                    row = json.loads(line)
+                    t = timeutil.to_ms(row["t"])
+                except Exception:
+                    continue
+                if t >= cutoff:
+                    ts.append(t)
+                    rows.append([_num(row.get(ch)) for ch in FIELDS])
+        written.seed(ts)
+        if not ts:
+            return
+        columns = dict(zip(FIELDS, zip(*rows)))
+        # 派生通道整列重算（旧历史里没有这些字段）
+        columns.update(derived_engine.compute(columns))
+        resampler.add(ts, columns, timeutil.now_ms())
     except Exception as e:
         print(
             f"{datetime.datetime.now().strftime('[%H:%M:%S]')} History load error: {e}"
         )
 
 
-def append_history(weather_data):
-    """追加一条数据到历史文件，并裁剪到最多24小时(288条)"""
+def _num(v):
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return float("nan")
+
+
+def _cell(v):
+    """NaN -> None：JSON 里写 null，图表上显示为缺口"""
+    return None if v != v else round(v, 4)
+
+
+def compute_derived(weather_data) -> dict:
+    """逐帧计算派生通道，算不出的记 None"""
+    values = derived_engine.update(
+        {
+            "temperature": weather_data[0],
+            "humidity": weather_data[1],
+            "pressure": weather_data[2],
+        }
+    )
+    return {name: _cell(values.get(name, float("nan"))) for name in derived_engine.names}
+
+
+def append_history(weather_data, extra=None):
+    """追加一条数据到历史文件，并裁剪掉 WINDOW_MS 以前的行"""
     row = {
         "t": weather_data[3],
         "temperature": weather_data[0],
         "humidity": weather_data[1],
         "pressure": weather_data[2],
     }
+    if extra:
+        row.update(extra)
+    line = json.dumps(row, ensure_ascii=False) + "\n"
     try:
-        # 1) 先追加一行
-        with HISTORY_PATH.open("a", encoding="utf-8") as f:
-            f.write(json.dumps(row, ensure_ascii=False) + "\n")
-            f.flush()
-            os.fsync(f.fileno())
+        # 1) 先追加一行（历史文件 + 长期归档）
+        # 归档可能正在被 derived.py 回填重写，追加要和它共用一把锁
+        for path in (HISTORY_PATH, ARCHIVE_PATH):
+            archive.append(path, line)
 
-        # 2) 再裁剪到最多 MAX_POINTS 行（读尾部再原子替换）
+        # 2) 再裁剪掉窗口以前的行（读出来再原子替换）
         with HISTORY_PATH.open("r", encoding="utf-8") as f:
             lines = f.readlines()
-        if len(lines) > MAX_POINTS:
-            lines = lines[-MAX_POINTS:]
+        cutoff = timeutil.now_ms() - WINDOW_MS
+        keep = 0
+        while keep < len(lines) and _line_time(lines[keep]) < cutoff:
+            keep += 1
+        if keep:
+            lines = lines[keep:]
             tmp = str(HISTORY_PATH) + ".tmp"
             with open(tmp, "w", encoding="utf-8") as f:
                 f.writelines(lines)
@@ -79,22 +170,33 @@ def append_history(weather_data):
         )
 
 
-def get_data():
+def _line_time(line: str) -> int:
     try:
-        with open("/var/www/html/data_seis.json", "r", encoding="utf-8") as f:
-            data = json.load(f)
-        temperature = _to_float(data["temperature"], "temperature")
-        humidity = _to_float(data["humidity"], "humidity")
-        pressure = _to_float(data["pressure"], "pressure")
-        # 避免跨天 x 轴重复：尽量用完整时间
-        ca = str(data.get("create_at", "")).strip()
-        if len(ca) >= 19 and ca[4] == "-" and ca[7] == "-" and ca[10] in (" ", "T"):
-            create_at = ca[:19].replace("T", " ")
-        else:
-            create_at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    except Exception as e:
-        print(f"{datetime.datetime.now().strftime('[%H:%M:%S]')} Error: {e}")
-        return None
+        return timeutil.to_ms(json.loads(line)["t"])
+    except Exception:
+        return -1
+
+
+def add_sample(weather_data, extra, now: int):
+    """一条新样本进网格（晚到的落回原来的格子，时间戳超前本机太多的不收）"""
+    columns = dict(zip(FIELDS, weather_data))
+    columns.update(extra)
+    return resampler.add(
+        [weather_data[3]],
+        [[_num(columns.get(ch)) for ch in CHANNELS]],
+        now,
+    )
+
+
+def _parse(data: dict):
+    temperature = _to_float(data["temperature"], "temperature")
+    humidity = _to_float(data["humidity"], "humidity")
+    pressure = _to_float(data["pressure"], "pressure")
+    # epoch 毫秒（兼容旧版采集端的时间字符串）
+    try:
+        create_at = timeutil.to_ms(data["create_at"])
+    except (KeyError, ValueError):
+        create_at = timeutil.now_ms()
     return (
         temperature,
         humidity,
@@ -103,6 +205,47 @@ def get_data():
     )
 
 
+def get_data():
+    try:
+        with open("/var/www/html/data_seis.json", "r", encoding="utf-8") as f:
+            return _parse(json.load(f))
+    except Exception as e:
+        print(f"{datetime.datetime.now().strftime('[%H:%M:%S]')} Error: {e}")
+        return None
+
+
+def drain_spool():
+    """取走 air_data_seis_client.py 攒下的全部样本（远端模式），按时间排序"""
+    samples = []
+    for line in archive.drain(archive.SEIS_SPOOL):
+        try:
+            samples.append(_parse(json.loads(line)))
+        except Exception:
+            continue
+    samples.sort(key=lambda s: s[3])
+    return samples
+
+
+def write_columnar(t, columns):
+    """把当前网格写成列式文件（字段名与 history_seis.jsonl 一致，缺口为 NaN）"""
+    try:
+        columnar.write(COLUMNAR_PATH, t, columns)
+    except Exception as e:
+        print(
+            f"{datetime.datetime.now().strftime('[%H:%M:%S]')} Columnar write error: {e}"
+        )
+
+
+def render():
+    """按当前网格重画所有图表并更新 history_seis.bin"""
+    t, columns = resampler.grid()
+    x = t.tolist()
+    for name, (y_name, title, html_name) in {**CHARTS, **DERIVED_CHARTS}.items():
+        if name in columns:
+            plot(x, [_cell(v) for v in columns[name].tolist()], y_name, title, html_name)
+    write_columnar(t, columns)
+
+
 def plot(x, y, y_name, plot_name, html_name):
     line = (
         Line(init_opts=opts.InitOpts(width="100%", height="815px"))
@@ -110,12 +253,14 @@ def plot(x, y, y_name, plot_name, html_name):
         .add_yaxis(y_name, y, is_smooth=True, label_opts=opts.LabelOpts(is_show=False))
         .set_global_opts(
             title_opts=opts.TitleOpts(title=plot_name),
-            xaxis_opts=opts.AxisOpts(
-                axislabel_opts=opts.LabelOpts(rotate=90, interval=0, is_show=False)
-            ),
+            tooltip_opts=opts.TooltipOpts(trigger="axis"),
+            # 时间轴：x 为 epoch 毫秒，由浏览器按本地时区格式化，数据缺口如实显示
+            xaxis_opts=opts.AxisOpts(type_="time"),
             yaxis_opts=opts.AxisOpts(is_scale=True),
         )
     )
+    # 时间轴的 x 已经在每个 [x, y] 数据点里了，不再重复输出一份 xAxis.data
+    line.options["xAxis"][0].pop("data", None)
     page = Page(layout=Page.SimplePageLayout, page_title=plot_name)
     page.add(line)
     # 原子写入：避免 Nginx/浏览器读到半截文件
@@ -132,42 +277,55 @@ def plot(x, y, y_name, plot_name, html_name):
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="地震仪测站数据绘图")
+    parser.add_argument(
+        "--resolution",
+        type=resample.parse_width,
+        default=resample.parse_width(RESOLUTION),
+        help=f"图表网格分辨率（默认 {RESOLUTION}）",
+    )
+    parser.add_argument(
+        "--poll",
+        type=float,
+        default=POLL_SECONDS,
+        help="读取 spool / data_seis.json 的间隔（秒）",
+    )
+    args = parser.parse_args()
+    resampler = make_resampler(args.resolution)
 
     load_history()
 
+    last_bucket = None
     while True:
         try:
-            weather_data = get_data()
-            if weather_data is not None:
-                append_history(weather_data)
-                temperature_list.append(weather_data[0])
-                humidity_list.append(weather_data[1])
-                pressure_list.append(weather_data[2])
-                createat_list.append(weather_data[3])
-                plot(
-                    list(createat_list),
-                    list(temperature_list),
-                    "温度 (℃)",
-                    "测站环境温度",
-                    "/var/www/html/temperature_seis.html",
-                )
-                plot(
-                    list(createat_list),
-                    list(humidity_list),
-                    "湿度 (%RH)",
-                    "测站环境湿度",
-                    "/var/www/html/humidity_seis.html",
-                )
-                plot(
-                    list(createat_list),
-                    list(pressure_list),
-                    "大气压 (hPa)",
-                    "测站环境大气压",
-                    "/var/www/html/pressure_seis.html",
-                )
-                time.sleep(300)
-            else:
-                time.sleep(5)
+            # 远端模式下样本来自 spool（一条不漏，含晚到的）；本地串口模式只有
+            # data_seis.json。两边重叠的样本由 written 按 create_at 去重，
+            # 归档里不会有重复行；写不写历史与网格收没收无关。
+            # 远端时钟超前太多的样本直接丢弃（见 timeutil.MAX_CLOCK_SKEW_MS），
+            # 晚到样本会追加在归档末尾，归档不保证时间严格有序。
+            samples = drain_spool()
+            current = get_data()
+            if current is not None:
+                samples.append(current)
+            now = timeutil.now_ms()
+            for weather_data in samples:
+                if weather_data[3] > now + timeutil.MAX_CLOCK_SKEW_MS:
+                    print(
+                        f"{datetime.datetime.now().strftime('[%H:%M:%S]')} "
+                        f"样本时间戳超前本机 {(weather_data[3] - now) // 1000} s，丢弃喵"
+                    )
+                    continue
+                extra = compute_derived(weather_data)
+                add_sample(weather_data, extra, now)
+                if written.add(weather_data[3], now):
+                    append_history(weather_data, extra)
+            now = timeutil.now_ms()
+            bucket = now // resampler.width
+            if bucket != last_bucket:
+                last_bucket = bucket
+                resampler.advance(now)
+                render()
+            time.sleep(args.poll)
         except Exception as e:
             print(f"{datetime.datetime.now().strftime('[%H:%M:%S]')} Error: {e}")
             time.sleep(1)
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+"""
+运行时性能剖析：不停机地给长时间运行的主循环做一段有时限的剖析。
+
+开启方式：
+    - 启动参数 --profile（立即开始）
+    - 向进程发 SIGUSR1：kill -USR1 <pid>（信号处理里只记一笔，下一个 tick 才真正开始）
+
+剖析窗口内同时做三件事：
+    - cProfile 统计主线程的函数耗时
+    - 每个 tick 拍一张 tracemalloc 快照，与上一张做差，找内存增长点
+    - 按阶段（read / decode / publish / plot ...）统计耗时
+窗口结束后在后台线程写报告（.txt + 可用 snakeviz 打开的 .prof），
+只保留最近 keep 份，数据采集不受影响。
+"""
+import os
+import glob
+import time
+import logging
+import signal
+import pstats
+import cProfile
+import datetime
+import threading
+import contextlib
+import tracemalloc
+
+PROFILE_DIR = "/var/tmp/weatherstation-profile"
+# 默认剖析窗口（秒），到期后在下一个 tick 结束
+PROFILE_WINDOW = 300
+# 每个进程最多保留几份报告
+PROFILE_KEEP = 10
+# 两次 tracemalloc 快照之间的最短间隔（秒），tick 很密时不至于每轮都拍
+SNAPSHOT_INTERVAL = 1.0
+# 报告里各部分列出的条数
+TOP_N = 25
+
+log = logging.getLogger("profiling")
+
+_NULL_STAGE = contextlib.nullcontext()
+# 内存差异里不关心的文件（tracemalloc 自身、导入机制）
+_IGNORED_FILES = (tracemalloc.__file__, "<frozen importlib._bootstrap")
+
+
+def _top_diffs(new, old):
+    """两张快照按行号做差，去掉无关文件，返回前 TOP_N 条"""
+    out = []
+    for s in new.compare_to(old, "lineno"):
+        if not (s.size_diff or s.count_diff):
+            continue
+        if s.traceback[0].filename.startswith(_IGNORED_FILES):
+            continue
+        out.append(str(s))
+        if len(out) >= TOP_N:
+            break
+    return out
+
+
+class _StageTimer:
+    __slots__ = ("samples", "t0")
+
+    def __init__(self, samples):
+        self.samples = samples
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.samples.append(time.perf_counter() - self.t0)
+        return False
+
+
+class Profiler:
+    def __init__(
+        self,
+        name: str,
+        out_dir: str = PROFILE_DIR,
+        window: float = PROFILE_WINDOW,
+        keep: int = PROFILE_KEEP,
+    ):
+        self.name = name
+        self.out_dir = out_dir
+        self.window = float(window)
+        self.keep = int(keep)
+        self.active = False
+        # SIGUSR1 只置这个标志，由主循环在 tick() 里开始剖析
+        self.requested = False
+        self._reset()
+
+    def _reset(self):
+        self.prof = None
+        self.stages = {}
+        self.ticks = 0
+        self.started = 0.0
+        self.snapshot_at = 0.0
+        self.first_snapshot = None
+        self.last_snapshot = None
+        self.mem_diffs = []
+        self._own_tracemalloc = False
+
+    def install_signal(self, signum=signal.SIGUSR1):
+        """
+        收到信号就在下一个 tick 开始一段剖析（已经在剖析中则忽略）。
+        信号处理函数打断的是主线程的任意位置，里面不做快照、不开 cProfile、
+        不写日志（主线程正在 print 时再输出会触发 BufferedWriter 重入错误）。
+        """
+
+        def handler(*_):
+            self.requested = True
+
+        signal.signal(signum, handler)
+
+    def start(self):
+        self.requested = False
+        if self.active:
+            return
+        self._reset()
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(5)
+            self._own_tracemalloc = True
+        self.first_snapshot = self.last_snapshot = tracemalloc.take_snapshot()
+        self.started = self.snapshot_at = time.monotonic()
+        self.prof = cProfile.Profile()
+        self.prof.enable()
+        self.active = True
+        log.info("开始性能剖析喵～ 窗口 %.0fs -> %s", self.window, self.out_dir)
+
+    def stage(self, name: str):
+        """with profiler.stage("read"): ... —— 未剖析时几乎零开销"""
+        if not self.active:
+            return _NULL_STAGE
+        samples = self.stages.get(name)
+        if samples is None:
+            samples = self.stages[name] = []
+        return _StageTimer(samples)
+
+    def tick(self):
+        """主循环每轮调用一次：处理 SIGUSR1 请求，记录内存差异，窗口到期就收尾"""
+        if self.requested:
+            self.start()
+            return
+        if not self.active:
+            return
+        self.ticks += 1
+        now = time.monotonic()
+        if now - self.snapshot_at >= SNAPSHOT_INTERVAL:
+            # 拍快照本身不计入 cProfile
+            self.prof.disable()
+            snap = tracemalloc.take_snapshot()
+            self.mem_diffs.append((self.ticks, _top_diffs(snap, self.last_snapshot)))
+            self.last_snapshot = snap
+            self.snapshot_at = time.monotonic()
+            self.prof.enable()
+        if now - self.started >= self.window:
+            self.stop()
+
+    def stop(self):
+        if not self.active:
+            return
+        self.prof.disable()
+        self.active = False
+        elapsed = time.monotonic() - self.started
+        stats = pstats.Stats(self.prof)
+        total = _top_diffs(self.last_snapshot, self.first_snapshot)
+        stages = self.stages
+        mem_diffs = self.mem_diffs
+        ticks = self.ticks
+        if self._own_tracemalloc:
+            tracemalloc.stop()
+        self._reset()
+        # 格式化和写文件放到后台线程，主循环继续跑
+        threading.Thread(
+            target=self._dump,
+            args=(stats, stages, mem_diffs, total, ticks, elapsed),
+            daemon=True,
+        ).start()
+
+    def _dump(self, stats, stages, mem_diffs, total, ticks, elapsed):
+        try:
+            os.makedirs(self.out_dir, exist_ok=True)
+            base = os.path.join(
+                self.out_dir,
+                f"{self.name}-{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}",
+            )
+            stats.dump_stats(base + ".prof")
+            with open(base + ".txt", "w", encoding="utf-8") as f:
+                f.write(f"{self.name}: {elapsed:.1f}s, {ticks} ticks\n\n")
+                f.write("== 阶段耗时 (ms) ==\n")
+                f.write(
+                    f"{'stage':<32}{'count':>8}{'total':>12}{'mean':>10}"
+                    f"{'p95':>10}{'max':>10}\n"
+                )
+                for name, samples in sorted(stages.items()):
+                    s = sorted(samples)
+                    n = len(s)
+                    f.write(
+                        f"{name:<32}{n:>8}{sum(s) * 1e3:>12.2f}"
+                        f"{sum(s) / n * 1e3:>10.3f}"
+                        f"{s[min(n - 1, int(n * 0.95))] * 1e3:>10.3f}"
+                        f"{s[-1] * 1e3:>10.3f}\n"
+                    )
+                f.write("\n== cProfile（按累计时间） ==\n")
+                stats.stream = f
+                stats.sort_stats("cumulative").print_stats(TOP_N)
+                f.write("\n== 内存增长（窗口首尾对比） ==\n")
+                for line in total:
+                    f.write(f"{line}\n")
+                f.write("\n== 内存增长（逐 tick） ==\n")
+                for tick, lines in mem_diffs:
+                    if not lines:
+                        continue
+                    f.write(f"-- tick {tick}\n")
+                    for line in lines:
+                        f.write(f"{line}\n")
+            self._rotate()
+            log.info("性能剖析报告已写入: %s.txt", base)
+        except Exception as e:
+            log.error("性能剖析报告写入失败喵… 错误: %s", e)
+
+    def _rotate(self):
+        """每种文件只保留最近 keep 份"""
+        for ext in (".txt", ".prof"):
+            files = sorted(glob.glob(os.path.join(self.out_dir, f"{self.name}-*{ext}")))
+            for old in files[: -self.keep]:
+                try:
+                    os.remove(old)
+                except OSError:
+                    pass
+
+
+def add_arguments(parser):
+    """给各脚本的 argparse 加上剖析相关参数"""
+    parser.add_argument("--profile", action="store_true", help="启动后立即开始剖析")
+    parser.add_argument(
+        "--profile-window", type=float, default=PROFILE_WINDOW, help="剖析窗口（秒）"
+    )
+    parser.add_argument("--profile-dir", default=PROFILE_DIR, help="剖析报告目录")
+
+
+def setup(profiler: Profiler, args):
+    """按命令行参数配置 profiler，并挂上 SIGUSR1"""
+    profiler.out_dir = args.profile_dir
+    profiler.window = args.profile_window
+    profiler.install_signal()
+    if args.profile:
+        profiler.start()
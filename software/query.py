@@ -0,0 +1,484 @@
+# -*- coding: utf-8 -*-
+"""
+按时间段查询/导出测站历史数据。
+
+历史文件（JSONL）旁边维护一个二进制时间索引 <文件>.idx：
+每行一条 (时间戳 ms, 字节偏移)，文件追加后只增量索引新增的行。
+查询时在索引上二分查找直接 seek 到时间段起点，只解析范围内的行，
+按块做向量化聚合，边算边输出，不把整个文件读进内存。
+派生通道（dew_point、aqi_pm2.5、usv_dose……）和实测通道一样可以查询，
+归档行里没有的（旧数据）按块现算，见 derived.py。
+
+用法：
+    python query.py main --start 2026-03-01 --end 2026-04-01 \
+        --channels pm2.5 --agg mean --bucket 1h --format csv -o pm25_march.csv
+"""
+import os
+import sys
+import csv
+import json
+import zlib
+import struct
+import argparse
+import datetime
+
+import numpy as np
+
+import archive
+import columnar
+import derived
+import resample
+import timeutil
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet 导出是可选功能
+    pa = None
+    pq = None
+
+# 测站 -> 长期归档文件（plot.py / plot_seis.py 追加写入，不裁剪）
+STATIONS = {
+    "main": "/var/www/html/archive.jsonl",
+    "seis": "/var/www/html/archive_seis.jsonl",
+}
+
+INDEX_MAGIC = b"WSIDX002"
+# 头部：magic + 已索引字节数 + 文件 inode + 文件开头的 crc32（用来发现文件被重写：
+# derived.py 回填等整文件重写都是 os.replace，inode 必变）
+INDEX_HEADER = struct.Struct("<8sqqI4x")
+INDEX_DTYPE = np.dtype([("t", "<i8"), ("off", "<i8")])
+# 计算 crc 用的文件开头字节数
+FINGERPRINT_SIZE = 256
+# 每次处理多少行
+CHUNK_ROWS = 65536
+# 归档按追加顺序写，不保证时间严格有序：远端补发的晚到样本追加在后面。
+# 绘图端只写 24 h 窗口内的样本，所以一行最多比它前面的行晚这么多（留了余量）
+MAX_LATENESS_MS = archive.MAX_LATENESS_MS
+
+AGGS = ("raw",) + resample.AGGS
+
+
+def parse_arg_time(value: str) -> int:
+    """命令行时间：epoch 毫秒，或 YYYY-MM-DD[ HH:MM[:SS]]（本地时间）"""
+    if value.isdigit():
+        return int(value)
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            dt = datetime.datetime.strptime(value.replace("T", " "), fmt)
+        except ValueError:
+            continue
+        return int(dt.timestamp() * 1000)
+    raise argparse.ArgumentTypeError(f"无法解析时间: {value!r}")
+
+
+def parse_bucket(value: str) -> int:
+    """桶宽：5m / 1h / 1d ... -> 毫秒"""
+    try:
+        return resample.parse_width(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def _fingerprint(path: str) -> int:
+    with open(path, "rb") as f:
+        return zlib.crc32(f.read(FINGERPRINT_SIZE))
+
+
+def _last_entry_ok(path: str, idx_path: str) -> bool:
+    """索引的最后一条：那个偏移上的行是否还是那个时间戳"""
+    with open(idx_path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        if f.tell() < INDEX_HEADER.size + INDEX_DTYPE.itemsize:
+            return True
+        f.seek(-INDEX_DTYPE.itemsize, os.SEEK_END)
+        t, off = np.frombuffer(f.read(INDEX_DTYPE.itemsize), dtype=INDEX_DTYPE)[0]
+    with open(path, "rb") as f:
+        f.seek(int(off))
+        line = f.readline()
+    try:
+        return timeutil.to_ms(json.loads(line)["t"]) == int(t)
+    except Exception:
+        return False
+
+
+def update_index(path: str) -> np.ndarray:
+    """
+    增量更新 path 的时间索引并返回（只读 memmap）。
+    文件被替换（inode 变了）、变短、开头变了，或者最后一条索引的偏移
+    对不上原来的行（被重写/裁剪）就整个重建。
+    """
+    idx_path = path + ".idx"
+    st = os.stat(path)
+    size = st.st_size
+    crc = _fingerprint(path) if size >= FINGERPRINT_SIZE else None
+
+    indexed = 0
+    if os.path.exists(idx_path):
+        with open(idx_path, "rb") as f:
+            head = f.read(INDEX_HEADER.size)
+        if len(head) == INDEX_HEADER.size:
+            magic, indexed, ino, old_crc = INDEX_HEADER.unpack(head)
+            if magic != INDEX_MAGIC or indexed > size or ino != st.st_ino:
+                indexed = 0
+            elif crc is not None and indexed >= FINGERPRINT_SIZE and old_crc != crc:
+                indexed = 0
+            elif indexed and not _last_entry_ok(path, idx_path):
+                indexed = 0
+
+    if indexed == 0 or indexed < size:
+        mode = "r+b" if indexed else "wb"
+        with open(path, "rb") as src, open(idx_path, mode) as idx:
+            if not indexed:
+                idx.write(INDEX_HEADER.pack(INDEX_MAGIC, 0, st.st_ino, 0))
+            idx.seek(0, os.SEEK_END)
+            src.seek(indexed)
+            pos = indexed
+            rows = []
+            for line in src:
+                if not line.endswith(b"\n"):
+                    # 最后一行还没写完，下次再索引
+                    break
+                try:
+                    rows.append((timeutil.to_ms(json.loads(line)["t"]), pos))
+                except Exception:
+                    pass
+                pos += len(line)
+                if len(rows) >= CHUNK_ROWS:
+                    idx.write(np.array(rows, dtype=INDEX_DTYPE).tobytes())
+                    rows = []
+            if rows:
+                idx.write(np.array(rows, dtype=INDEX_DTYPE).tobytes())
+            idx.seek(0)
+            idx.write(INDEX_HEADER.pack(INDEX_MAGIC, pos, st.st_ino, crc or 0))
+
+    if os.path.getsize(idx_path) == INDEX_HEADER.size:
+        return np.zeros(0, dtype=INDEX_DTYPE)
+    return np.memmap(idx_path, dtype=INDEX_DTYPE, mode="r", offset=INDEX_HEADER.size)
+
+
+def iter_range(path: str, start: int, end: int, channels):
+    """
+    逐块产出 [start, end) 内的 (时间戳数组, 数值矩阵 n×len(channels))。
+    缺失/坏值为 NaN。
+    """
+    index = update_index(path)
+    if not len(index):
+        return
+    # 索引按追加顺序；用前缀最大值做二分键，个别乱序行也不会让二分出错。
+    # lo 之前的行都早于 start；但晚到的行可能排在时间 >= end 的行后面，
+    # 所以 hi 按 end + MAX_LATENESS_MS 找，多读的行下面按时间过滤掉
+    keys = np.maximum.accumulate(index["t"])
+    lo = int(np.searchsorted(keys, start, side="left"))
+    hi = int(np.searchsorted(keys, end + MAX_LATENESS_MS, side="left"))
+    if lo >= hi:
+        return
+
+    with open(path, "rb") as f:
+        for s in range(lo, hi, CHUNK_ROWS):
+            e = min(s + CHUNK_ROWS, hi)
+            ts = np.asarray(index["t"][s:e])
+            # 一块的行在文件里是连续的，一次读进来再按偏移切
+            base = int(index["off"][s])
+            f.seek(base)
+            blob = f.read(int(index["off"][e]) - base) if e < len(index) else f.read()
+            values = np.full((e - s, len(channels)), np.nan)
+            for i, off in enumerate((index["off"][s:e] - base).tolist()):
+                nl = blob.find(b"\n", off)
+                try:
+                    row = json.loads(blob[off : nl if nl >= 0 else None])
+                except ValueError:
+                    continue
+                for j, ch in enumerate(channels):
+                    try:
+                        values[i, j] = float(row[ch])
+                    except (KeyError, TypeError, ValueError):
+                        pass
+            keep = (ts >= start) & (ts < end)
+            if not keep.all():
+                ts = ts[keep]
+                values = values[keep]
+            if len(ts):
+                yield ts, values
+
+
+def iter_channels(path: str, start: int, end: int, channels, altitude: float = None):
+    """
+    在 iter_range 的基础上支持派生通道：归档里存了就直接用，
+    缺失（旧数据没回填）的位置用实测通道现算。
+    """
+    wanted = [ch for ch in channels if ch in derived.DERIVED or ch == derived.DOSE_CHANNEL]
+    if not wanted:
+        yield from iter_range(path, start, end, channels)
+        return
+    inputs = set()
+    for ch in wanted:
+        inputs.update(derived.inputs_of(ch))
+    engine = derived.DerivedEngine(inputs, altitude)
+    read = list(channels) + sorted(inputs - set(channels))
+    col = {ch: j for j, ch in enumerate(read)}
+    # 当日剂量要从本地零点开始积分
+    read_start = derived.day_start_ms(start) if derived.DOSE_CHANNEL in wanted else start
+    for ts, values in iter_range(path, read_start, end, read):
+        computed = engine.compute({ch: values[:, col[ch]] for ch in inputs}, ts)
+        for ch in wanted:
+            if ch in computed:
+                j = col[ch]
+                missing = np.isnan(values[:, j])
+                values[missing, j] = computed[ch][missing]
+        values = values[:, : len(channels)]
+        if read_start != start:
+            keep = ts >= start
+            ts, values = ts[keep], values[keep]
+        if len(ts):
+            yield ts, values
+
+
+class BucketAggregator:
+    """
+    流式分桶聚合：按块喂入有序数据，产出已经完整的桶。
+    桶边界按本地时区对齐（1d 的桶就是本地自然日），统计量和去重见 resample.py。
+    fill_gaps 时 [start, end) 里没有数据的桶也输出一行（全 NaN）。
+    """
+
+    def __init__(
+        self,
+        width: int,
+        agg: str,
+        channels: int,
+        utc_offset_ms: int = 0,
+        fill_gaps: bool = False,
+        start: int = None,
+        end: int = None,
+    ):
+        self.width = width
+        self.agg = agg
+        self.channels = channels
+        self.offset = utc_offset_ms
+        self.fill_gaps = fill_gaps
+        self.pending = None
+        # 下一个该输出的桶号（补缺口用）
+        self.next_bid = None if start is None else (start + self.offset) // width
+        self.end_bid = None if end is None else (end - 1 + self.offset) // width
+
+    def _finish(self, stats):
+        if self.fill_gaps and len(stats.bid):
+            first = stats.bid[0] if self.next_bid is None else min(self.next_bid, stats.bid[0])
+            full = resample.empty(np.arange(first, stats.bid[-1] + 1), self.channels)
+            idx = stats.bid - first
+            for field, arr in zip(resample.Stats._fields[1:], stats[1:]):
+                getattr(full, field)[idx] = arr
+            stats = full
+        if len(stats.bid):
+            self.next_bid = stats.bid[-1] + 1
+        t = stats.bid * self.width - self.offset
+        return t, resample.finish(stats, self.agg)
+
+    def feed(self, ts, values):
+        stats = resample.bucket_reduce(ts, values, self.width, self.offset)
+        if self.pending is not None:
+            pb = self.pending.bid[0]
+            # 比待定桶还早的行（乱序晚到，所在桶已经输出过）丢弃
+            stats = resample.take(stats, stats.bid >= pb)
+            if not len(stats.bid):
+                return None
+            if stats.bid[0] == pb:
+                head = resample.combine(self.pending, resample.take(stats, slice(0, 1)))
+                stats = resample.concat(head, resample.take(stats, slice(1, None)))
+            else:
+                stats = resample.concat(self.pending, stats)
+        # 最后一个桶可能还没收齐，留到下一块
+        self.pending = resample.take(stats, slice(-1, None))
+        if len(stats.bid) > 1:
+            return self._finish(resample.take(stats, slice(None, -1)))
+        return None
+
+    def flush(self):
+        stats, self.pending = self.pending, None
+        if self.fill_gaps and self.end_bid is not None:
+            # 补齐到 end 所在的桶
+            first = self.next_bid if stats is None else stats.bid[-1] + 1
+            if first is not None and first <= self.end_bid:
+                gap = resample.empty(np.arange(first, self.end_bid + 1), self.channels)
+                stats = gap if stats is None else resample.concat(stats, gap)
+        return None if stats is None else self._finish(stats)
+
+
+def query(
+    path: str,
+    start: int,
+    end: int,
+    channels,
+    agg="raw",
+    bucket=None,
+    altitude=None,
+    fill_gaps=False,
+):
+    """
+    产出 (时间戳数组, 数值矩阵) 块；agg != raw 时每行是一个桶，
+    同一时间戳的重复行只算一次，fill_gaps 时空桶输出 NaN 行。
+    """
+    if agg == "raw":
+        yield from iter_channels(path, start, end, channels, altitude)
+        return
+    # 用起点所在时刻的本地 UTC 偏移对齐桶边界
+    local = datetime.datetime.fromtimestamp(start / 1000).astimezone()
+    offset = int(local.utcoffset().total_seconds() * 1000)
+    agg_state = BucketAggregator(
+        bucket, agg, len(channels), offset, fill_gaps, start, end
+    )
+    for ts, values in iter_channels(path, start, end, channels, altitude):
+        out = agg_state.feed(ts, values)
+        if out is not None:
+            yield out
+    out = agg_state.flush()
+    if out is not None:
+        yield out
+
+
+def _cell(v):
+    return None if np.isnan(v) else float(v)
+
+
+def _time_column(ts, local_time: bool):
+    """t 列默认输出 epoch 毫秒；--local-time 时格式化成本地时间字符串"""
+    if local_time:
+        return [timeutil.format_ms(t) for t in ts.tolist()]
+    return ts.tolist()
+
+
+class CsvWriter:
+    def __init__(self, f, channels, local_time=False):
+        self.w = csv.writer(f)
+        self.w.writerow(["t", *channels])
+        self.local_time = local_time
+
+    def write(self, ts, values):
+        self.w.writerows(
+            [t, *("" if np.isnan(v) else repr(float(v)) for v in row)]
+            for t, row in zip(_time_column(ts, self.local_time), values)
+        )
+
+    def close(self):
+        pass
+
+
+class NdjsonWriter:
+    def __init__(self, f, channels, local_time=False):
+        self.f = f
+        self.channels = channels
+        self.local_time = local_time
+
+    def write(self, ts, values):
+        for t, row in zip(_time_column(ts, self.local_time), values):
+            rec = {"t": t}
+            rec.update(zip(self.channels, map(_cell, row)))
+            self.f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+
+    def close(self):
+        pass
+
+
+class ParquetWriter:
+    def __init__(self, path, channels):
+        if pq is None:
+            raise SystemExit("导出 Parquet 需要 pyarrow：pip install pyarrow")
+        self.channels = channels
+        self.schema = pa.schema(
+            [("t", pa.timestamp("ms"))] + [(ch, pa.float64()) for ch in channels]
+        )
+        self.w = pq.ParquetWriter(path, self.schema)
+
+    def write(self, ts, values):
+        cols = [pa.array(ts, type=pa.timestamp("ms"))]
+        cols += [pa.array(values[:, j], from_pandas=True) for j in range(len(self.channels))]
+        self.w.write_table(pa.Table.from_arrays(cols, schema=self.schema))
+
+    def close(self):
+        self.w.close()
+
+
+class ColumnarWriter:
+    """二进制列式文件需要先知道行数：块在内存里攒着（每行只有几十字节），最后一次写出"""
+
+    def __init__(self, path, channels):
+        self.path = path
+        self.channels = channels
+        self.ts = []
+        self.values = []
+
+    def write(self, ts, values):
+        self.ts.append(ts)
+        self.values.append(values)
+
+    def close(self):
+        n = len(self.channels)
+        ts = np.concatenate(self.ts) if self.ts else np.zeros(0, dtype=np.int64)
+        values = np.vstack(self.values) if self.values else np.zeros((0, n))
+        columnar.write(
+            self.path, ts, {ch: values[:, j] for j, ch in enumerate(self.channels)}
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="按时间段查询/导出测站历史数据")
+    parser.add_argument("station", help=f"测站（{' / '.join(STATIONS)}）或历史文件路径")
+    parser.add_argument("--start", type=parse_arg_time, required=True)
+    parser.add_argument("--end", type=parse_arg_time, required=True)
+    parser.add_argument(
+        "--channels", required=True, help="逗号分隔，如 pm2.5,pm10,dew_point,aqi_pm2.5"
+    )
+    parser.add_argument("--agg", default="raw", choices=AGGS)
+    parser.add_argument("--bucket", type=parse_bucket, default=None, help="桶宽，如 5m / 1h / 1d")
+    parser.add_argument(
+        "--format", default="csv", choices=("csv", "ndjson", "parquet", "bin")
+    )
+    parser.add_argument("-o", "--output", help="输出文件（默认 stdout，parquet/bin 必须给）")
+    parser.add_argument(
+        "--local-time", action="store_true", help="CSV/NDJSON 的 t 列输出本地时间字符串"
+    )
+    parser.add_argument(
+        "--fill-gaps", action="store_true", help="聚合时没有数据的桶也输出一行（空值）"
+    )
+    parser.add_argument(
+        "--altitude", type=float, default=None, help="测站海拔（米），现算海平面气压用"
+    )
+    args = parser.parse_args()
+
+    path = STATIONS.get(args.station, args.station)
+    channels = [c.strip() for c in args.channels.split(",") if c.strip()]
+    if args.agg != "raw" and not args.bucket:
+        parser.error("--agg 不是 raw 时需要 --bucket")
+    if args.format in ("parquet", "bin") and not args.output:
+        parser.error(f"{args.format} 格式需要 -o")
+
+    if args.format == "parquet":
+        f = None
+        writer = ParquetWriter(args.output, channels)
+    elif args.format == "bin":
+        f = None
+        writer = ColumnarWriter(args.output, channels)
+    else:
+        f = open(args.output, "w", encoding="utf-8", newline="") if args.output else sys.stdout
+        writer_cls = CsvWriter if args.format == "csv" else NdjsonWriter
+        writer = writer_cls(f, channels, args.local_time)
+    try:
+        for ts, values in query(
+            path,
+            args.start,
+            args.end,
+            channels,
+            args.agg,
+            args.bucket,
+            args.altitude,
+            args.fill_gaps,
+        ):
+            writer.write(ts, values)
+    finally:
+        writer.close()
+        if f is not None and f is not sys.stdout:
+            f.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+把不规则的原始样本重采样到固定时间网格上。
+
+    - 桶宽可配（5m / 1m / 1h ...），桶边界对齐到 epoch（可加本地时区偏移）
+    - 每个桶按通道聚合：mean / last / max / min，全部向量化
+    - 没有样本的桶输出 NaN（图表上是缺口，JSON 里是 null），不会把后面的数据挤过来
+    - 同一时间戳的重复样本只算一次（重启后重读、远端重复推送）
+    - 晚到的样本只要还在窗口内就补进对应的桶，太旧的丢弃
+    - 时间戳超前本机时钟太多的样本丢弃，不会把整个窗口推到未来清空
+
+Resampler 用环形缓冲保存最近 size 个桶，add() 只改动样本落到的桶，
+grid() 按时间顺序取出整个窗口；bucket_reduce() 是无状态的批量版本，
+query.py 的分桶聚合也用它。
+"""
+import collections
+
+import numpy as np
+
+import timeutil
+
+AGGS = ("mean", "last", "max", "min")
+UNITS = {"s": 1000, "m": 60_000, "h": 3_600_000, "d": 86_400_000}
+# last_t 的“空”值
+NO_TIME = np.iinfo(np.int64).min
+
+# 一批样本按桶归约后的统计量，每个字段第一维是桶，第二维是通道
+Stats = collections.namedtuple("Stats", "bid count total min max last last_t")
+
+
+def parse_width(value: str) -> int:
+    """'5m' / '1h' / '1d' / '30s' -> 毫秒"""
+    value = value.strip().lower()
+    if len(value) < 2 or value[-1] not in UNITS or not value[:-1].isdigit():
+        raise ValueError(f"桶宽格式不对: {value!r}（例如 5m / 1h / 1d）")
+    width = int(value[:-1]) * UNITS[value[-1]]
+    if width <= 0:
+        raise ValueError(f"桶宽必须大于 0: {value!r}")
+    return width
+
+
+def bucket_reduce(ts, values, width: int, offset: int = 0) -> Stats:
+    """
+    ts: epoch 毫秒（可乱序），values: n×C 矩阵（NaN 表示缺失）。
+    同一时间戳只保留最后出现的那一条，返回按桶号升序的 Stats。
+    """
+    ts = np.asarray(ts, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64).reshape(len(ts), -1)
+    order = np.argsort(ts, kind="stable")
+    ts = ts[order]
+    values = values[order]
+    # 稳定排序后相同时间戳相邻，保留每组最后一条
+    keep = np.r_[ts[1:] != ts[:-1], True]
+    if not keep.all():
+        ts = ts[keep]
+        values = values[keep]
+
+    bid = (ts + offset) // width
+    starts = np.flatnonzero(np.r_[True, bid[1:] != bid[:-1]])
+    valid = ~np.isnan(values)
+    count = np.add.reduceat(valid, starts, axis=0).astype(np.int64)
+    total = np.add.reduceat(np.where(valid, values, 0.0), starts, axis=0)
+    mn = np.fmin.reduceat(values, starts, axis=0)
+    mx = np.fmax.reduceat(values, starts, axis=0)
+    # 每个桶里每个通道最后一个有效样本：行号单调，取组内最大的有效行号
+    rows = np.where(valid, np.arange(len(ts))[:, None], -1)
+    k = np.maximum.reduceat(rows, starts, axis=0)
+    has = k >= 0
+    k = np.maximum(k, 0)
+    last = np.where(has, np.take_along_axis(values, k, axis=0), np.nan)
+    last_t = np.where(has, ts[k], NO_TIME)
+    return Stats(bid[starts], count, total, mn, mx, last, last_t)
+
+
+def combine(a: Stats, b: Stats) -> Stats:
+    """同一组桶的两份统计量合并（逐元素，bid 取 a 的）"""
+    newer = b.last_t >= a.last_t
+    return Stats(
+        a.bid,
+        a.count + b.count,
+        a.total + b.total,
+        np.fmin(a.min, b.min),
+        np.fmax(a.max, b.max),
+        np.where(newer, b.last, a.last),
+        np.where(newer, b.last_t, a.last_t),
+    )
+
+
+def take(stats: Stats, idx) -> Stats:
+    """按桶切片 / 掩码"""
+    return Stats(*(f[idx] for f in stats))
+
+
+def concat(a: Stats, b: Stats) -> Stats:
+    """两组（按桶号先后）统计量首尾相接"""
+    return Stats(*(np.concatenate([x, y]) for x, y in zip(a, b)))
+
+
+def finish(stats: Stats, agg: str) -> np.ndarray:
+    """统计量 -> 聚合结果（空桶为 NaN）"""
+    if agg == "min":
+        return stats.min
+    if agg == "max":
+        return stats.max
+    if agg == "last":
+        return stats.last
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(stats.count > 0, stats.total / np.maximum(stats.count, 1), np.nan)
+
+
+def empty(bid, channels: int) -> Stats:
+    """一组空桶"""
+    n = len(bid)
+    return Stats(
+        np.asarray(bid, dtype=np.int64),
+        np.zeros((n, channels), dtype=np.int64),
+        np.zeros((n, channels)),
+        np.full((n, channels), np.nan),
+        np.full((n, channels), np.nan),
+        np.full((n, channels), np.nan),
+        np.full((n, channels), NO_TIME, dtype=np.int64),
+    )
+
+
+class Resampler:
+    """
+    增量重采样：保留最近 size 个宽 width 的桶。
+    aggs 给出各通道的聚合方式（默认 mean），比如累计量用 last。
+    """
+
+    def __init__(self, channels, width: int, size: int, aggs: dict = None, offset: int = 0):
+        self.channels = list(channels)
+        self.width = int(width)
+        self.size = int(size)
+        self.offset = int(offset)
+        aggs = aggs or {}
+        self.aggs = [aggs.get(ch, "mean") for ch in self.channels]
+        self.col = {ch: j for j, ch in enumerate(self.channels)}
+        self.end = None  # 窗口里最新的桶号
+        self.buf = empty(np.full(self.size, -1), len(self.channels))
+        # 桶号 -> 已收过的时间戳，跨批次去重
+        self.seen = {}
+        self.dropped = 0
+        self.duplicates = 0
+        self.future = 0
+
+    def advance(self, t: int):
+        """把窗口推进到 t 所在的桶（没有数据也推进，缺口才会显示出来）"""
+        bid = (int(t) + self.offset) // self.width
+        if self.end is None:
+            self.end = bid
+            self._clear(np.arange(bid - self.size + 1, bid + 1))
+        elif bid > self.end:
+            new = np.arange(max(self.end + 1, bid - self.size + 1), bid + 1)
+            self.end = bid
+            self._clear(new)
+            lo = bid - self.size + 1
+            for b in [b for b in self.seen if b < lo]:
+                del self.seen[b]
+
+    def _clear(self, bids):
+        slots = bids % self.size
+        fresh = empty(bids, len(self.channels))
+        for field, arr in zip(Stats._fields, fresh):
+            getattr(self.buf, field)[slots] = arr
+
+    def add(self, ts, values, now: int = None) -> int:
+        """
+        喂入一批样本：ts 为 epoch 毫秒序列，values 为 n×C（按 channels 顺序，
+        或 {通道: 序列}）。返回实际收下的样本数。
+        给了 now（本机当前时间）就丢弃晚于 now + MAX_CLOCK_SKEW_MS 的样本。
+        """
+        ts = np.asarray(ts, dtype=np.int64).reshape(-1)
+        if isinstance(values, dict):
+            mat = np.full((len(ts), len(self.channels)), np.nan)
+            for ch, col in values.items():
+                if ch in self.col:
+                    mat[:, self.col[ch]] = np.asarray(col, dtype=np.float64)
+            values = mat
+        values = np.asarray(values, dtype=np.float64).reshape(len(ts), len(self.channels))
+        if now is not None and len(ts):
+            ok = ts <= now + timeutil.MAX_CLOCK_SKEW_MS
+            if not ok.all():
+                self.future += int((~ok).sum())
+                ts = ts[ok]
+                values = values[ok]
+        if not len(ts):
+            return 0
+        self.advance(int(ts.max()))
+
+        bid = (ts + self.offset) // self.width
+        keep = bid > self.end - self.size
+        self.dropped += int((~keep).sum())
+        # 跨批次去重：同一桶里出现过的时间戳不再计入
+        fresh = np.array(
+            [
+                k and t not in self.seen.get(b, ())
+                for k, t, b in zip(keep.tolist(), ts.tolist(), bid.tolist())
+            ],
+            dtype=bool,
+        )
+        self.duplicates += int(keep.sum() - fresh.sum())
+        if not fresh.any():
+            return 0
+        ts = ts[fresh]
+        values = values[fresh]
+        for t, b in zip(ts.tolist(), ((ts + self.offset) // self.width).tolist()):
+            self.seen.setdefault(b, set()).add(t)
+
+        new = bucket_reduce(ts, values, self.width, self.offset)
+        slots = new.bid % self.size
+        old = take(self.buf, slots)
+        merged = combine(old, new)
+        for field in Stats._fields[1:]:
+            getattr(self.buf, field)[slots] = getattr(merged, field)
+        self.buf.bid[slots] = new.bid
+        return len(ts)
+
+    def grid(self):
+        """
+        按时间顺序返回整个窗口：(桶起点 epoch 毫秒数组, {通道: 聚合值数组})，
+        空桶为 NaN。
+        """
+        if self.end is None:
+            return np.zeros(0, dtype=np.int64), {ch: np.zeros(0) for ch in self.channels}
+        bids = np.arange(self.end - self.size + 1, self.end + 1)
+        slots = bids % self.size
+        window = take(self.buf, slots)
+        out = {}
+        for agg in set(self.aggs):
+            values = finish(window, agg)
+            for j, ch in enumerate(self.channels):
+                if self.aggs[j] == agg:
+                    out[ch] = values[:, j]
+        t = bids * self.width - self.offset
+        return t, {ch: out[ch] for ch in self.channels}
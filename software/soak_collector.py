@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""
+collector.py 的压力测试：用 pty 对模拟几十台测站，逐级提高发包速率，
+测出单进程能稳定承受的最大总帧率和每帧延迟。
+
+模拟测站在子进程里往 pty 主端写包，采集器在本进程里从 pty 从端读。
+每帧第 0 个 float 放序号，第 1 个 float 放发送时刻（10µs 为单位，对 2^24 取模，
+float32 能精确表示），采集器解出来后直接算延迟，不需要两边共享状态。
+
+用法：
+    python soak_collector.py --stations 48 --rate 5 --max-rate 2000 --duration 5
+"""
+import os
+import tty
+import time
+import struct
+import argparse
+import multiprocessing
+
+import collector
+from air_data_seis import calculate_checksum
+
+# 发送时刻的单位（ns）和回绕周期：10µs * 2^24 ≈ 167 s，远大于任何合理延迟
+TICK_NS = 10_000
+TICK_WRAP = 1 << 24
+
+
+def now_tick() -> int:
+    return (time.monotonic_ns() // TICK_NS) % TICK_WRAP
+
+
+def make_frame(packer: struct.Struct, nfloats: int, seq: int) -> bytes:
+    values = [float(seq % TICK_WRAP), float(now_tick())]
+    values += [20.0 + i for i in range(nfloats - 2)]
+    body = packer.pack(*values)
+    return collector.SYNC_BYTE + body + bytes([calculate_checksum(body)])
+
+
+def simulate(masters, schema, rate, duration, result_queue):
+    """子进程：每 1/rate 秒给每台测站各写一帧"""
+    fmt, fields = collector.SCHEMAS[schema]
+    packer = struct.Struct(fmt)
+    nfloats = len(fields)
+    for fd in masters:
+        os.set_blocking(fd, False)
+
+    sent = 0
+    overruns = 0
+    seq = 0
+    interval = 1.0 / rate
+    start = time.monotonic()
+    deadline = start + duration
+    next_tick = start
+    while True:
+        now = time.monotonic()
+        if now >= deadline:
+            break
+        if now < next_tick:
+            time.sleep(next_tick - now)
+        next_tick += interval
+        for fd in masters:
+            try:
+                os.write(fd, make_frame(packer, nfloats, seq))
+                sent += 1
+            except BlockingIOError:
+                # pty 缓冲区满：采集器跟不上
+                overruns += 1
+        seq += 1
+    result_queue.put((sent, overruns, time.monotonic() - start))
+
+
+class LatencySink:
+    """采集器的 sink：统计收到的帧数和延迟"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.received = 0
+        self.latencies = []
+
+    def __call__(self, st, record):
+        sent_tick = int(record[st.decoder.fields[1]])
+        self.latencies.append(((now_tick() - sent_tick) % TICK_WRAP) * TICK_NS / 1e6)
+        self.received += 1
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return float("nan")
+    k = min(len(sorted_values) - 1, int(round(p / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[k]
+
+
+def run_step(col, sink, masters, schema, rate, duration):
+    """以每台 rate Hz 跑 duration 秒，返回这一级的统计"""
+    sink.reset()
+    failures_before = sum(st.decoder.checksum_failures for st in col.stations)
+
+    ctx = multiprocessing.get_context("fork")
+    result_queue = ctx.Queue()
+    proc = ctx.Process(
+        target=simulate, args=(masters, schema, rate, duration, result_queue)
+    )
+    proc.start()
+    while proc.is_alive():
+        col.poll(timeout=0.1)
+    # 把缓冲区里剩下的读完
+    drain_until = time.monotonic() + 0.5
+    while time.monotonic() < drain_until:
+        col.poll(timeout=0.05)
+    proc.join()
+    sent, overruns, elapsed = result_queue.get()
+
+    lat = sorted(sink.latencies)
+    failures = (
+        sum(st.decoder.checksum_failures for st in col.stations) - failures_before
+    )
+    return {
+        "rate": rate,
+        "sent": sent,
+        "received": sink.received,
+        "overruns": overruns,
+        "checksum_failures": failures,
+        "agg_rate": sink.received / elapsed if elapsed > 0 else 0.0,
+        "p50": percentile(lat, 50),
+        "p99": percentile(lat, 99),
+        "max": lat[-1] if lat else float("nan"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="collector.py 多测站压力测试")
+    parser.add_argument("--stations", type=int, default=48, help="模拟测站数量")
+    parser.add_argument("--schema", default="main", choices=sorted(collector.SCHEMAS))
+    parser.add_argument("--rate", type=float, default=5.0, help="起始速率（每台 Hz）")
+    parser.add_argument("--max-rate", type=float, default=2000.0, help="最高速率（每台 Hz）")
+    parser.add_argument("--factor", type=float, default=2.0, help="每级速率倍数")
+    parser.add_argument("--duration", type=float, default=5.0, help="每级持续秒数")
+    parser.add_argument(
+        "--max-latency-ms", type=float, default=50.0, help="p99 延迟上限（毫秒）"
+    )
+    parser.add_argument(
+        "--publish-dir", help="同时把每台测站的数据写到这个目录（测含写文件的开销）"
+    )
+    args = parser.parse_args()
+
+    pairs = []
+    stations = []
+    for i in range(args.stations):
+        master, slave = os.openpty()
+        tty.setraw(slave)
+        pairs.append((master, slave))
+        output = None
+        if args.publish_dir:
+            output = os.path.join(args.publish_dir, f"sim{i:03d}.json")
+        stations.append(
+            collector.Station(
+                name=f"sim{i:03d}",
+                port=os.ttyname(slave),
+                baudrate=115200,
+                schema=args.schema,
+                output=output,
+            )
+        )
+    masters = [m for m, _ in pairs]
+
+    sink = LatencySink()
+    col = collector.Collector(stations, sink=sink, event_log=None)
+    col.poll(timeout=0)
+
+    print(
+        f"{'每台Hz':>8} {'总帧率':>10} {'发送':>8} {'接收':>8} {'溢出':>6} "
+        f"{'校验失败':>8} {'p50ms':>8} {'p99ms':>8} {'maxms':>8}"
+    )
+    best = None
+    rate = args.rate
+    try:
+        while rate <= args.max_rate:
+            r = run_step(col, sink, masters, args.schema, rate, args.duration)
+            print(
+                f"{r['rate']:>8.1f} {r['agg_rate']:>10.1f} {r['sent']:>8} "
+                f"{r['received']:>8} {r['overruns']:>6} {r['checksum_failures']:>8} "
+                f"{r['p50']:>8.2f} {r['p99']:>8.2f} {r['max']:>8.2f}"
+            )
+            ok = (
+                r["overruns"] == 0
+                and r["checksum_failures"] == 0
+                and r["received"] >= r["sent"]
+                and r["p99"] <= args.max_latency_ms
+            )
+            if not ok:
+                break
+            best = r
+            rate *= args.factor
+    finally:
+        col.close()
+        for master, slave in pairs:
+            os.close(master)
+            os.close(slave)
+
+    if best is None:
+        print("起始速率就撑不住喵…")
+    else:
+        print(
+            f"\n{args.stations} 台测站，最大可持续总帧率 ≈ {best['agg_rate']:.0f} 帧/s "
+            f"（每台 {best['rate']:.1f} Hz），p50 {best['p50']:.2f} ms，"
+            f"p99 {best['p99']:.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
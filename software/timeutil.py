@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""
+时间戳工具：系统内部统一用 UTC epoch 毫秒（int），只在显示时格式化。
+
+旧数据里的 "%Y-%m-%d %H:%M:%S" 字符串（本地时间）由 to_ms() 兼容转换。
+"""
+import time
+import datetime
+
+LEGACY_FORMAT = "%Y-%m-%d %H:%M:%S"
+# 样本时间戳最多允许比本机时钟超前多少（远端测站的 create_at 用的是它自己的时钟），
+# 超过的当作时钟错误：不进图表网格，也不写历史 / 归档
+MAX_CLOCK_SKEW_MS = 10 * 60 * 1000
+
+
+def now_ms() -> int:
+    """当前时间（UTC epoch 毫秒），每个样本只取一次"""
+    return time.time_ns() // 1_000_000
+
+
+def to_ms(value) -> int:
+    """把 int 毫秒 / 数字字符串 / 旧格式时间字符串统一转成 epoch 毫秒"""
+    if isinstance(value, bool):
+        raise ValueError(f"Invalid timestamp={value!r}")
+    if isinstance(value, (int, float)):
+        return int(value)
+    s = str(value).strip()
+    if s.isdigit():
+        return int(s)
+    if len(s) >= 19 and s[4] == "-" and s[7] == "-" and s[10] in (" ", "T"):
+        # 形如 2026-01-18 12:34:56 / 2026-01-18T12:34:56（本地时间）
+        dt = datetime.datetime.strptime(s[:19].replace("T", " "), LEGACY_FORMAT)
+        return int(dt.timestamp() * 1000)
+    raise ValueError(f"Invalid timestamp={value!r}")
+
+
+def format_ms(ms: int, fmt: str = LEGACY_FORMAT) -> str:
+    """显示用：epoch 毫秒 -> 本地时间字符串"""
+    return datetime.datetime.fromtimestamp(ms / 1000).strftime(fmt)